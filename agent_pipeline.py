@@ -5,12 +5,22 @@ Intent Analysis → Search Plan → Search → Answer の流れを制御
 """
 
 import asyncio
-import json
-from typing import Dict, List, Any, Optional, Annotated
+import functools
+import io
+import logging
+import os
+import re
+from logging.handlers import RotatingFileHandler
+from contextlib import aclosing
+from typing import Dict, List, Any, Optional, Annotated, AsyncGenerator, Awaitable, Callable
 from datetime import datetime
 import time
 from pathlib import Path
 
+import orjson
+
+from semantic_cache import SemanticCache
+
 # 新しいモジュール構造からインポート
 try:
     from tools import web_search_function
@@ -36,15 +46,187 @@ except ImportError:
         error: Optional[str]
     
     NEW_MODULES_AVAILABLE = False
+    
+    def _search_sync(ddgs: DDGS, query: str, max_results: int) -> List[Dict[str, Any]]:
+        """DDGSで同期的に検索し結果を整形（asyncio.to_thread 経由で呼び出す）"""
+        return [
+            {
+                "title": result.get("title", ""),
+                "url": result.get("href", ""),
+                "snippet": result.get("body", "")
+            }
+            for result in ddgs.text(query, max_results=max_results)
+        ]
+
+
+class _JsonEndDetector:
+    """
+    ストリーミング出力中の最初のJSONオブジェクトの終端を検出
+    
+    <think>ブロック内と文字列リテラル内の波括弧は無視する
+    """
+    
+    def __init__(self):
+        self._tail = ""
+        self._in_think = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+    
+    def feed(self, token: str) -> bool:
+        """トークンを追加し、JSONオブジェクトが閉じたらTrueを返す"""
+        for ch in token:
+            # タグ検出用に直近の文字だけ保持
+            self._tail = (self._tail + ch)[-8:]
+            if self._in_think:
+                if self._tail.endswith("</think>"):
+                    self._in_think = False
+                continue
+            if self._tail.endswith("<think>"):
+                self._in_think = True
+                continue
+            
+            if self._depth == 0:
+                if ch == "{":
+                    self._depth = 1
+                continue
+            
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            
+            if ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    return True
+        return False
+
+
+# LLM出力からJSON部分を抽出するための正規表現（<think>ブロックを除去してから適用）
+_THINK_RE = re.compile(r'<think>[\s\S]*?</think>')
+_JSON_RE = re.compile(r'\{[\s\S]*\}')
+
+
+def _parse_llm_json(response: str) -> Dict[str, Any]:
+    """
+    LLM出力に含まれるJSONオブジェクトを解析
+    
+    前後の説明文や思考ブロックは無視する。JSONが見つからない・解析できない
+    場合は ValueError を送出する
+    """
+    match = _JSON_RE.search(_THINK_RE.sub("", response))
+    if match is None:
+        raise ValueError("JSONオブジェクトが見つかりません")
+    data = orjson.loads(match.group(0))
+    if not isinstance(data, dict):
+        raise ValueError("JSONオブジェクトではありません")
+    return data
+
+
+# 思考ログの生レスポンスを完全な形で保持するかどうか（DEBUG_THINKING=1 で有効）
+DEBUG_THINKING = os.getenv("DEBUG_THINKING", "0") == "1"
+# 非デバッグ時に思考ログへ残す生レスポンス・出力の最大文字数
+THINKING_LOG_PREVIEW_CHARS = 500
+RAW_RESPONSE_LOG_FILE = "raw_responses.log"
+
+
+@functools.lru_cache(maxsize=1)
+def _get_raw_response_logger() -> logging.Logger:
+    """生レスポンス記録用のロガーを取得（初回のみローテーション付きファイルハンドラを設定）"""
+    logger = logging.getLogger("agent_pipeline.raw_response")
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    handler = RotatingFileHandler(
+        RAW_RESPONSE_LOG_FILE, maxBytes=10 * 1024 * 1024, backupCount=3, encoding="utf-8"
+    )
+    handler.setFormatter(logging.Formatter("%(asctime)s [%(name)s] %(message)s"))
+    logger.addHandler(handler)
+    return logger
+
+
+def _truncate_for_log(text: str) -> str:
+    """思考ログ用に長いテキストを切り詰める（デバッグ時はそのまま返す）"""
+    if DEBUG_THINKING or len(text) <= THINKING_LOG_PREVIEW_CHARS:
+        return text
+    return text[:THINKING_LOG_PREVIEW_CHARS] + "...(truncated)"
+
+
+def _record_raw_response(step: str, response: str) -> str:
+    """
+    LLMの生レスポンスを記録し、思考ログに格納する値を返す
+    
+    デバッグ時は完全なレスポンスをファイルに書き出し、
+    それ以外は切り詰めたプレビューのみを返す
+    """
+    if DEBUG_THINKING:
+        _get_raw_response_logger().debug("%s: %s", step, response)
+    return _truncate_for_log(response)
+
+
+def _thinking_log_for_transport(thinking_log: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """クライアントへ返す思考ログから生レスポンスを除去（デバッグ時はそのまま返す）"""
+    if DEBUG_THINKING:
+        return thinking_log
+    return [
+        {k: v for k, v in entry.items() if k != "raw_response"}
+        for entry in thinking_log
+    ]
+
+
+DEFAULT_SYSTEM_PROMPT = "あなたは日本語で応答する親切なAIアシスタントです。"
+
+# 回答生成プロンプトのテンプレート（固定部分はモジュール読み込み時に一度だけ構築）
+ANSWER_PROMPT_TEMPLATE = """
+以下の情報を基に、ユーザーの質問に答えてください：
+
+質問: {user_query}
+意図分析: {intent_analysis}
+検索結果: {context}
+
+段階的な思考プロセスを<think>タグ内で示してから、最終的な回答を提供してください。
+"""
+
+
+@functools.lru_cache(maxsize=1)
+def _load_system_prompt_cached(path: str = "prompts/system_prompt.txt") -> str:
+    """システムプロンプトを読み込み（プロセス内で一度だけファイルにアクセス）"""
+    try:
+        prompt_path = Path(path)
+        if prompt_path.exists():
+            return prompt_path.read_text(encoding="utf-8")
+        else:
+            return DEFAULT_SYSTEM_PROMPT
+    except Exception as e:
+        print(f"システムプロンプトの読み込みエラー: {e}")
+        return DEFAULT_SYSTEM_PROMPT
 
 
 class AdvancedRAGPipeline:
     """LangGraph DAG を使用した高度なRAGパイプライン"""
     
-    def __init__(self, model_name: str = "qwen3:30b", base_url: str = "http://localhost:11434"):
+    def __init__(self,
+                 model_name: str = "qwen3:30b",
+                 base_url: str = "http://localhost:11434",
+                 fast_model_name: Optional[str] = None):
+        """
+        Args:
+            fast_model_name: 意図分析・検索計画など軽量なタスク用のモデル
+                （未指定の場合は環境変数 FAST_MODEL_NAME、それも無ければ model_name を使用）
+        """
         self.model_name = model_name
+        self.fast_model_name = fast_model_name or os.getenv("FAST_MODEL_NAME") or model_name
         self.base_url = base_url
         self.thinking_log = []
+        self._client: Optional["httpx.AsyncClient"] = None
         
         # 新しいモジュール構造を使用
         if NEW_MODULES_AVAILABLE:
@@ -54,51 +236,145 @@ class AdvancedRAGPipeline:
             self.llm_client = None
             # システムプロンプトを読み込み
             self.system_prompt = self._load_system_prompt()
+        
+        # 意図分析・検索計画ノード用のキャッシュ（回答生成はキャッシュしない）
+        # 類似度検索は意図分析のみ。検索計画は完全一致でのみ再利用する
+        self.semantic_cache = SemanticCache(
+            embed_function=self.llm_client.generate_embedding if self.llm_client else None
+        )
     
     def _load_system_prompt(self) -> str:
         """システムプロンプトを読み込み"""
-        try:
-            prompt_path = Path("prompts/system_prompt.txt")
-            if prompt_path.exists():
-                return prompt_path.read_text(encoding="utf-8")
-            else:
-                return "あなたは日本語で応答する親切なAIアシスタントです。"
-        except Exception as e:
-            print(f"システムプロンプトの読み込みエラー: {e}")
-            return "あなたは日本語で応答する親切なAIアシスタントです。"
+        return _load_system_prompt_cached()
     
-    async def _call_llm(self, messages: List[Dict[str, str]]) -> str:
-        """LLMを呼び出し"""
+    async def _call_llm(self, 
+                        messages: List[Dict[str, str]], 
+                        cache_namespace: Optional[str] = None,
+                        cache_key: Optional[str] = None,
+                        on_token: Optional[Callable[[str], Awaitable[None]]] = None,
+                        stop_at_json: bool = False,
+                        model: Optional[str] = None,
+                        semantic_match: bool = True) -> str:
+        """
+        LLMを呼び出し（ストリーミングで受信して連結）
+        
+        Args:
+            messages: メッセージのリスト
+            cache_namespace: セマンティックキャッシュのネームスペース（Noneの場合はキャッシュしない）
+            cache_key: キャッシュのキーとなるテキスト（通常はユーザーの質問）
+            on_token: トークン受信ごとに呼び出すコールバック
+            stop_at_json: 最初のJSONオブジェクトが閉じた時点で受信を打ち切るかどうか
+            model: 使用するモデル名（Noneの場合は self.model_name）
+            semantic_match: 類似した質問のキャッシュも使うかどうか（Falseの場合は完全一致のみ）
+        """
+        use_cache = cache_namespace is not None and bool(cache_key)
+        if use_cache:
+            cached = await self.semantic_cache.lookup(cache_namespace, cache_key, semantic=semantic_match)
+            if cached is not None:
+                return cached
+        
         try:
-            # 新しいモジュール構造を使用
-            if NEW_MODULES_AVAILABLE and self.llm_client:
-                return await self.llm_client.generate_response(messages)
-            else:
-                # フォールバック実装
-                return await self._fallback_call_llm(messages)
+            try:
+                response = await self._collect_llm_response(messages, on_token, stop_at_json, model)
+            except Exception as e:
+                # 軽量モデルが未取得（404）の場合は既定のモデルで1回だけ再試行し、以降も既定のモデルを使う
+                if not (model and model != self.model_name and getattr(e, "status", None) == 404):
+                    raise
+                print(f"モデル {model} が見つからないため {self.model_name} を使用します")
+                if model == self.fast_model_name:
+                    self.fast_model_name = self.model_name
+                response = await self._collect_llm_response(messages, on_token, stop_at_json, self.model_name)
                 
         except Exception as e:
             raise Exception(f"LLM呼び出しエラー: {str(e)}")
+        
+        if use_cache:
+            await self.semantic_cache.store(cache_namespace, cache_key, response, semantic=semantic_match)
+        
+        return response
+    
+    async def _collect_llm_response(self,
+                                    messages: List[Dict[str, str]],
+                                    on_token: Optional[Callable[[str], Awaitable[None]]],
+                                    stop_at_json: bool,
+                                    model: Optional[str]) -> str:
+        """LLMのストリーミング応答を受信して連結"""
+        content_parts = []
+        detector = _JsonEndDetector() if stop_at_json else None
+        
+        async with aclosing(self._stream_llm(messages, model)) as stream:
+            async for token in stream:
+                content_parts.append(token)
+                if on_token is not None:
+                    await on_token(token)
+                if detector is not None and detector.feed(token):
+                    # JSONが完成した時点で残りの生成を待たずに終了
+                    break
+        
+        return "".join(content_parts)
+    
+    def _stream_llm(self,
+                    messages: List[Dict[str, str]],
+                    model: Optional[str] = None) -> AsyncGenerator[str, None]:
+        """LLMのストリーミング応答を取得"""
+        # 新しいモジュール構造を使用
+        if NEW_MODULES_AVAILABLE and self.llm_client:
+            return self.llm_client.stream_response(messages, model_name=model)
+        # フォールバック実装
+        return self._fallback_stream_llm(messages, model)
+    
+    async def _get_client(self) -> "httpx.AsyncClient":
+        """共有HTTPクライアントを取得（初回呼び出し時に生成し、以降は再利用）"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(30.0),
+                limits=httpx.Limits(max_keepalive_connections=32, max_connections=64)
+            )
+        return self._client
+    
+    async def close(self):
+        """共有HTTPクライアントを閉じる（アプリケーション終了時に呼び出す）"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self.llm_client is not None:
+            await self.llm_client.aclose()
     
-    async def _fallback_call_llm(self, messages: List[Dict[str, str]]) -> str:
-        """フォールバック用のLLM呼び出し"""
+    async def _fallback_stream_llm(self,
+                                   messages: List[Dict[str, str]],
+                                   model: Optional[str] = None) -> AsyncGenerator[str, None]:
+        """フォールバック用のLLMストリーミング呼び出し"""
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{self.base_url}/api/chat",
-                    json={
-                        "model": self.model_name,
-                        "messages": messages,
-                        "stream": False
-                    },
-                    timeout=30.0
-                )
-                
+            client = await self._get_client()
+            async with client.stream(
+                "POST",
+                "/api/chat",
+                content=orjson.dumps({
+                    "model": model or self.model_name,
+                    "messages": messages,
+                    "stream": True
+                }),
+                headers={"Content-Type": "application/json"}
+            ) as response:
                 if response.status_code != 200:
                     raise Exception(f"Ollama API エラー: {response.status_code}")
                 
-                result = response.json()
-                return result["message"]["content"]
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    try:
+                        data = orjson.loads(line)
+                    except orjson.JSONDecodeError:
+                        continue
+                    
+                    content = data.get("message", {}).get("content")
+                    if content:
+                        yield content
+                    
+                    # ストリーミング完了を確認
+                    if data.get("done", False):
+                        break
                 
         except Exception as e:
             raise Exception(f"LLM呼び出しエラー: {str(e)}")
@@ -124,29 +400,16 @@ class AdvancedRAGPipeline:
         """フォールバック用のWeb検索"""
         for attempt in range(max_retries):
             try:
-                # 日本語検索を優先
-                search_query = f"{query} lang:ja"
-                results = []
+                ddgs = DDGS()
                 
-                with DDGS() as ddgs:
-                    for result in ddgs.text(search_query, max_results=max_results):
-                        results.append({
-                            "title": result.get("title", ""),
-                            "url": result.get("href", ""),
-                            "snippet": result.get("body", "")
-                        })
+                # 日本語検索を優先（ブロッキングなDDGS呼び出しはスレッドで実行）
+                results = await asyncio.to_thread(_search_sync, ddgs, f"{query} lang:ja", max_results)
                 
                 # 日本語検索で結果が少ない場合は英語でも検索
                 if len(results) < max_results:
-                    with DDGS() as ddgs:
-                        for result in ddgs.text(query, max_results=max_results-len(results)):
-                            results.append({
-                                "title": result.get("title", ""),
-                                "url": result.get("href", ""),
-                                "snippet": result.get("body", "")
-                            })
+                    results += await asyncio.to_thread(_search_sync, ddgs, query, max_results - len(results))
                 
-                return results if results else []
+                return results
                 
             except Exception as e:
                 if attempt < max_retries - 1:
@@ -189,12 +452,18 @@ JSON形式で回答してください：
                 {"role": "user", "content": analysis_prompt}
             ]
             
-            response = await self._call_llm(messages)
+            response = await self._call_llm(
+                messages,
+                cache_namespace="intent",
+                cache_key=state['user_query'],
+                stop_at_json=True,
+                model=self.fast_model_name
+            )
             
             # JSON解析を試行
             try:
-                intent_data = json.loads(response)
-            except json.JSONDecodeError:
+                intent_data = _parse_llm_json(response)
+            except ValueError:
                 # JSON解析に失敗した場合はテキスト解析
                 intent_data = {
                     "question_type": "general",
@@ -211,7 +480,7 @@ JSON形式で回答してください：
                 "duration": time.time() - start_time,
                 "input": state['user_query'],
                 "output": intent_data,
-                "raw_response": response
+                "raw_response": _record_raw_response("intent_analysis", response)
             }
             
             state['thinking_log'].append(thinking_entry)
@@ -230,24 +499,26 @@ JSON形式で回答してください：
             state['error'] = f"意図分析エラー: {str(e)}"
             return state
     
-    async def search_plan_node(self, state: AgentState) -> AgentState:
-        """検索計画ノード"""
+    def _skipped_search_plan(self) -> Dict[str, Any]:
+        """検索不要時の検索計画"""
+        return {
+            "keywords": [],
+            "search_needed": False,
+            "reason": "検索が不要な質問"
+        }
+    
+    async def search_plan_node_standalone(self, state: AgentState) -> AgentState:
+        """
+        検索計画ノード（意図分析に依存しない版）
+        
+        質問文のみからプロンプトを組み立てるため、意図分析ノードと並列に実行できる
+        """
         start_time = time.time()
         
         try:
-            if not state['intent_analysis'].get('needs_search', True):
-                # 検索が不要な場合はスキップ
-                state['search_plan'] = {
-                    "keywords": [],
-                    "search_needed": False,
-                    "reason": "検索が不要な質問"
-                }
-                return state
-            
             plan_prompt = f"""
 以下の質問に対する検索計画を立ててください：
 質問: {state['user_query']}
-意図分析: {state['intent_analysis']['analysis']}
 
 検索キーワードと戦略をJSON形式で回答してください：
 {{
@@ -263,12 +534,20 @@ JSON形式で回答してください：
                 {"role": "user", "content": plan_prompt}
             ]
             
-            response = await self._call_llm(messages)
+            response = await self._call_llm(
+                messages,
+                cache_namespace="search_plan",
+                cache_key=state['user_query'],
+                stop_at_json=True,
+                model=self.fast_model_name,
+                # 検索キーワードは質問中の固有名詞に依存するため、類似した質問の計画は流用しない
+                semantic_match=False
+            )
             
             # JSON解析を試行
             try:
-                plan_data = json.loads(response)
-            except json.JSONDecodeError:
+                plan_data = _parse_llm_json(response)
+            except ValueError:
                 # JSON解析に失敗した場合はフォールバック
                 plan_data = {
                     "keywords": [state['user_query']],
@@ -284,7 +563,7 @@ JSON形式で回答してください：
                 "duration": time.time() - start_time,
                 "input": state['user_query'],
                 "output": plan_data,
-                "raw_response": response
+                "raw_response": _record_raw_response("search_plan", response)
             }
             
             state['thinking_log'].append(thinking_entry)
@@ -314,24 +593,28 @@ JSON形式で回答してください：
             
             # 検索キーワードを取得
             keywords = state['search_plan'].get('keywords', [state['user_query']])
-            all_results = []
             
-            # 各キーワードで検索実行
-            for keyword in keywords[:2]:  # 最大2つのキーワード
-                search_results = await self._web_search_with_retry(keyword)
-                all_results.extend(search_results)
+            # 各キーワードで並列に検索実行（最大2つのキーワード）
+            search_lists = await asyncio.gather(
+                *(self._web_search_with_retry(keyword) for keyword in keywords[:2]),
+                return_exceptions=True
+            )
             
-            # 重複排除（URLベース）
-            unique_results = []
+            # 重複排除（URLベース）を1回の走査で行い、上位5件に達した時点で打ち切る
+            search_results = []
             seen_urls = set()
-            for result in all_results:
-                url = result.get('url', '')
-                if url and url not in seen_urls:
-                    seen_urls.add(url)
-                    unique_results.append(result)
-            
-            # 上位5件に制限
-            search_results = unique_results[:5]
+            for results in search_lists:
+                if isinstance(results, Exception):
+                    continue
+                for result in results:
+                    url = result.get('url', '')
+                    if url and url not in seen_urls:
+                        seen_urls.add(url)
+                        search_results.append(result)
+                        if len(search_results) >= 5:
+                            break
+                if len(search_results) >= 5:
+                    break
             
             # 思考ログに記録
             thinking_entry = {
@@ -367,27 +650,29 @@ JSON形式で回答してください：
         
         try:
             # 検索結果をコンテキストに整理
-            context_parts = []
+            # 1つのバッファに順次書き込み、中間文字列の生成を避ける
+            buf = io.StringIO()
             for i, result in enumerate(state['search_results'], 1):
-                context_parts.append(f"""
-検索結果 {i}:
-タイトル: {result.get('title', 'N/A')}
-URL: {result.get('url', 'N/A')}
-内容: {result.get('snippet', 'N/A')}
-""")
-            
-            context = "\n".join(context_parts) if context_parts else "検索結果がありません。"
+                if i > 1:
+                    buf.write("\n")
+                buf.write("\n検索結果 ")
+                buf.write(str(i))
+                buf.write(":\nタイトル: ")
+                buf.write(str(result.get('title', 'N/A')))
+                buf.write("\nURL: ")
+                buf.write(str(result.get('url', 'N/A')))
+                buf.write("\n内容: ")
+                buf.write(str(result.get('snippet', 'N/A')))
+                buf.write("\n")
+            
+            context = buf.getvalue() or "検索結果がありません。"
             
             # 回答生成プロンプト
-            answer_prompt = f"""
-以下の情報を基に、ユーザーの質問に答えてください：
-
-質問: {state['user_query']}
-意図分析: {state['intent_analysis']}
-検索結果: {context}
-
-段階的な思考プロセスを<think>タグ内で示してから、最終的な回答を提供してください。
-"""
+            answer_prompt = ANSWER_PROMPT_TEMPLATE.format(
+                user_query=state['user_query'],
+                intent_analysis=state['intent_analysis'],
+                context=context
+            )
             
             messages = [
                 {"role": "system", "content": self.system_prompt},
@@ -402,7 +687,8 @@ URL: {result.get('url', 'N/A')}
                 "timestamp": datetime.now().isoformat(),
                 "duration": time.time() - start_time,
                 "input": state['user_query'],
-                "output": response,
+                # 回答全文は final_answer として返すため、ログにはプレビューのみ残す
+                "output": _truncate_for_log(response),
                 "context_length": len(context)
             }
             
@@ -451,28 +737,36 @@ URL: {result.get('url', 'N/A')}
             }
         
         try:
-            # 段階的処理の実行
-            state = await self.intent_analysis_node(state)
+            # 意図分析と検索計画を並列実行（それぞれ独立した状態のコピーで処理）
+            intent_state, plan_state = await asyncio.gather(
+                self.intent_analysis_node({**state, "thinking_log": []}),
+                self.search_plan_node_standalone({**state, "thinking_log": []})
+            )
+            state['thinking_log'].extend(intent_state['thinking_log'])
+            state['thinking_log'].extend(plan_state['thinking_log'])
+            state['intent_analysis'] = intent_state['intent_analysis']
+            state['search_plan'] = plan_state['search_plan']
+            state['error'] = intent_state.get('error') or plan_state.get('error')
             if state.get('error'):
-                return {"success": False, "error": state['error'], "thinking_log": state['thinking_log']}
+                return {"success": False, "error": state['error'], "thinking_log": _thinking_log_for_transport(state['thinking_log'])}
             
-            state = await self.search_plan_node(state)
-            if state.get('error'):
-                return {"success": False, "error": state['error'], "thinking_log": state['thinking_log']}
+            # 意図分析で検索不要と判定された場合は検索計画を破棄
+            if not state['intent_analysis'].get('needs_search', True):
+                state['search_plan'] = self._skipped_search_plan()
             
             state = await self.search_node(state)
             if state.get('error'):
-                return {"success": False, "error": state['error'], "thinking_log": state['thinking_log']}
+                return {"success": False, "error": state['error'], "thinking_log": _thinking_log_for_transport(state['thinking_log'])}
             
             state = await self.answer_node(state)
             if state.get('error'):
-                return {"success": False, "error": state['error'], "thinking_log": state['thinking_log']}
+                return {"success": False, "error": state['error'], "thinking_log": _thinking_log_for_transport(state['thinking_log'])}
             
             return {
                 "success": True,
                 "response": state['final_answer'],
                 "search_results": state['search_results'],
-                "thinking_log": state['thinking_log'],
+                "thinking_log": _thinking_log_for_transport(state['thinking_log']),
                 "intent_analysis": state['intent_analysis'],
                 "search_plan": state['search_plan']
             }
@@ -481,7 +775,7 @@ URL: {result.get('url', 'N/A')}
             return {
                 "success": False,
                 "error": f"パイプライン実行エラー: {str(e)}",
-                "thinking_log": state.get('thinking_log', [])
+                "thinking_log": _thinking_log_for_transport(state.get('thinking_log', []))
             }
 
 
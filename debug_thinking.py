@@ -2,8 +2,19 @@
 思考分離パーサーのデバッグスクリプト
 """
 
+import re
+
 from thinking_parser import ThinkingParser
 
+# 調査用パターン（モジュール読み込み時に一度だけコンパイル）
+_PATTERNS = [
+    (re.compile(r'<think>(.*?)</think>', re.DOTALL), "正規パターン"),
+    (re.compile(r'<think>(.*?)(?:</think>|$)', re.DOTALL), "柔軟パターン"),
+    (re.compile(r'<think>(.*?)(?=\n\n|\Z)', re.DOTALL), "改行区切りパターン"),
+    (re.compile(r'</think>', re.DOTALL), "終了タグのみ"),
+    (re.compile(r'<think>', re.DOTALL), "開始タグのみ")
+]
+
 # 実際のAPI応答をテスト
 test_response = """</think>
 
@@ -31,19 +42,10 @@ print(f"回答内容: '{result['answer'][:100]}...'")
 print()
 
 print("=== パターンマッチング調査 ===")
-import re
 
 # 各種パターンでテスト
-patterns = [
-    (r'<think>(.*?)</think>', "正規パターン"),
-    (r'<think>(.*?)(?:</think>|$)', "柔軟パターン"),
-    (r'<think>(.*?)(?=\n\n|\Z)', "改行区切りパターン"),
-    (r'</think>', "終了タグのみ"),
-    (r'<think>', "開始タグのみ")
-]
-
-for pattern, name in patterns:
-    match = re.search(pattern, test_response, re.DOTALL)
+for pattern, name in _PATTERNS:
+    match = pattern.search(test_response)
     print(f"{name}: {'✅ 発見' if match else '❌ 未発見'}")
     if match:
         print(f"  マッチ内容: '{match.group(0)[:50]}...'")
@@ -5,6 +5,9 @@
 from thinking_parser import ThinkingParser
 import re
 
+# 先頭の不完全な終了タグ（モジュール読み込み時に一度だけコンパイル）
+_STRAY_CLOSE = re.compile(r'</think>\s*')
+
 # 実際のAPI応答をテスト
 test_response = """</think>
 
@@ -27,7 +30,7 @@ def improved_parse(response):
     # </think>で始まる場合の特殊処理
     if response.startswith('</think>'):
         # </think>タグを全て削除し、残りを回答として扱う
-        cleaned_response = re.sub(r'</think>\s*', '', response).strip()
+        cleaned_response = _STRAY_CLOSE.sub('', response).strip()
         
         # 思考内容はなしとして扱う（モデルが不完全に生成した場合）
         return {
@@ -27,6 +27,9 @@ export function ChatInterface() {
     setConnectionStatus('connecting')
     
     const ws = new WebSocket('ws://localhost:8000/api/chat/stream')
+    // サーバーはJSONをバイナリフレームで送信する
+    ws.binaryType = 'arraybuffer'
+    const decoder = new TextDecoder()
     
     ws.onopen = () => {
       setConnectionStatus('connected')
@@ -35,7 +38,8 @@ export function ChatInterface() {
     
         ws.onmessage = (event) => {
       try {
-        const data = JSON.parse(event.data)
+        const raw = typeof event.data === 'string' ? event.data : decoder.decode(event.data)
+        const data = JSON.parse(raw)
         
         // 新しいバックエンドフォーマットを処理
         if (data.type === 'message') {
@@ -0,0 +1,43 @@
+"""
+共有HTTPクライアント
+プロセス全体で1つの httpx.AsyncClient を共有し、Ollama等への接続を再利用する
+"""
+
+from typing import Optional
+import httpx
+
+# HTTP/2 は h2 パッケージ（httpx[http2]）がある場合のみ有効化する
+# TLS経由の接続でのみネゴシエートされ、平文のローカルOllamaには HTTP/1.1 が使われる
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+_shared_client: Optional[httpx.AsyncClient] = None
+
+
+async def get_shared_client() -> httpx.AsyncClient:
+    """
+    共有HTTPクライアントを取得（初回呼び出し時に生成し、以降は再利用）
+
+    生成処理の間に await を挟まないため、同一イベントループ内での競合は発生しない
+    """
+    global _shared_client
+    if _shared_client is None or _shared_client.is_closed:
+        # Accept-Encoding（gzip, deflate 等）は httpx が利用可能なデコーダに応じて自動で付与する
+        _shared_client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            timeout=httpx.Timeout(30.0),
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=100)
+        )
+    return _shared_client
+
+
+async def close_shared_client():
+    """共有HTTPクライアントを閉じる（アプリケーション終了時に呼び出す）"""
+    global _shared_client
+    if _shared_client is not None:
+        await _shared_client.aclose()
+        _shared_client = None
@@ -4,15 +4,20 @@ KPI測定システム
 """
 
 import time
-import json
 import asyncio
-from typing import Dict, List, Any, Optional
+import orjson
+from typing import Dict, List, Any, Optional, Deque
 from datetime import datetime, timedelta
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass
 import asyncio
 import threading
-from collections import defaultdict
-import statistics
+from collections import Counter, deque
+from itertools import takewhile
+
+# 測定結果の保持上限と保持期間
+MAX_METRICS = 100_000
+METRICS_RETENTION = timedelta(hours=48)
+SEARCH_COUNT_RETENTION_DAYS = 7
 
 @dataclass
 class KPIMetrics:
@@ -29,8 +34,10 @@ class KPIMonitor:
     """KPI監視システム"""
     
     def __init__(self):
-        self.metrics: List[KPIMetrics] = []
-        self.daily_search_count = defaultdict(int)
+        # 時系列順に追加されるため、古いものから左端で削除できる
+        self.metrics: Deque[KPIMetrics] = deque(maxlen=MAX_METRICS)
+        self.daily_search_count: Counter = Counter()
+        # 古いデータの削除（保守処理）専用のロック。記録・参照のホットパスでは取得しない
         self.lock = threading.Lock()
         
     def start_measurement(self) -> float:
@@ -44,11 +51,16 @@ class KPIMonitor:
         search_requests: int = 0,
         bleu_score: Optional[float] = None,
         error_occurred: bool = False,
-        error_message: Optional[str] = None
+        error_message: Optional[str] = None,
+        end_time: Optional[float] = None
     ) -> KPIMetrics:
-        """測定結果を記録"""
+        """
+        測定結果を記録
+        
+        end_time を指定した場合はその時刻までをレイテンシとする（記録を後から行う場合に使用）
+        """
         
-        latency_ms = (time.time() - start_time) * 1000
+        latency_ms = ((end_time if end_time is not None else time.time()) - start_time) * 1000
         
         metric = KPIMetrics(
             timestamp=datetime.now(),
@@ -60,21 +72,49 @@ class KPIMonitor:
             error_message=error_message
         )
         
-        with self.lock:
-            self.metrics.append(metric)
-            
-            # 今日の日付でDDGリクエスト数を更新
-            today = datetime.now().date()
-            self.daily_search_count[today] += search_requests
+        # deque.append はGILの下でアトミックなためロック不要
+        self.metrics.append(metric)
+        
+        # 保持期間を過ぎた測定結果を削除（他スレッドが削除中なら待たずにスキップ）
+        if self.lock.acquire(blocking=False):
+            try:
+                cutoff_time = metric.timestamp - METRICS_RETENTION
+                while self.metrics and self.metrics[0].timestamp < cutoff_time:
+                    self.metrics.popleft()
+            finally:
+                self.lock.release()
             
         return metric
     
+    def record_search_requests(self, count: int = 1):
+        """
+        DDGへの実リクエスト数を記録
+        
+        検索キャッシュにヒットした場合は呼び出さないため、
+        日次のDDGリクエスト数はキャッシュミス分のみとなる
+        """
+        today = datetime.now().date()
+        if today not in self.daily_search_count and self.lock.acquire(blocking=False):
+            # 日付が変わったタイミングで古い日次カウントを削除
+            try:
+                oldest_date = today - timedelta(days=SEARCH_COUNT_RETENTION_DAYS)
+                for date in [d for d in list(self.daily_search_count) if d < oldest_date]:
+                    self.daily_search_count.pop(date, None)
+            finally:
+                self.lock.release()
+        self.daily_search_count[today] += count
+    
     def get_recent_metrics(self, hours: int = 24) -> List[KPIMetrics]:
         """最近の測定結果を取得"""
         cutoff_time = datetime.now() - timedelta(hours=hours)
         
-        with self.lock:
-            return [m for m in self.metrics if m.timestamp >= cutoff_time]
+        # 走査中の追加で例外が出ないよう、ロックを取らずにスナップショットを取得
+        snapshot = self.metrics.copy()
+        # 新しい順に走査し、期間外に達した時点で打ち切る
+        recent = list(takewhile(lambda m: m.timestamp >= cutoff_time, reversed(snapshot)))
+        
+        recent.reverse()
+        return recent
     
     def get_daily_stats(self) -> Dict[str, Any]:
         """日次統計を取得"""
@@ -92,16 +132,28 @@ class KPIMonitor:
                 "avg_bleu_score": None
             }
         
-        # 統計計算
-        valid_metrics = [m for m in recent_metrics if not m.error_occurred]
-        
-        avg_latency = statistics.mean([m.latency_ms for m in valid_metrics]) if valid_metrics else 0
-        avg_tokens = statistics.mean([m.token_count for m in valid_metrics]) if valid_metrics else 0
+        # 統計計算（1回の走査で全ての集計値を求める）
+        error_count = 0
+        latency_sum = 0.0
+        token_sum = 0
+        bleu_sum = 0.0
+        bleu_count = 0
+        for m in recent_metrics:
+            if m.error_occurred:
+                error_count += 1
+                continue
+            latency_sum += m.latency_ms
+            token_sum += m.token_count
+            if m.bleu_score is not None:
+                bleu_sum += m.bleu_score
+                bleu_count += 1
         
-        bleu_scores = [m.bleu_score for m in valid_metrics if m.bleu_score is not None]
-        avg_bleu = statistics.mean(bleu_scores) if bleu_scores else None
+        valid_count = len(recent_metrics) - error_count
+        avg_latency = latency_sum / valid_count if valid_count else 0
+        avg_tokens = token_sum / valid_count if valid_count else 0
+        avg_bleu = bleu_sum / bleu_count if bleu_count else None
         
-        error_rate = len([m for m in recent_metrics if m.error_occurred]) / len(recent_metrics)
+        error_rate = error_count / len(recent_metrics)
         
         return {
             "date": today.isoformat(),
@@ -165,18 +217,30 @@ class KPIMonitor:
         if filename is None:
             filename = f"kpi_metrics_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
         
-        with self.lock:
-            data = {
-                "export_time": datetime.now().isoformat(),
-                "metrics": [asdict(m) for m in self.metrics],
-                "daily_search_counts": {str(k): v for k, v in self.daily_search_count.items()}
-            }
+        # ロックを取らずにスナップショットを取得し、シリアライズはコピーに対して行う
+        metrics_snapshot = list(self.metrics)
+        search_counts = dict(self.daily_search_count)
+        
+        # orjsonはdataclassとdatetimeを直接シリアライズできるため asdict による複製は不要
+        data = {
+            "export_time": datetime.now(),
+            "metrics": metrics_snapshot,
+            "daily_search_counts": {str(k): v for k, v in search_counts.items()}
+        }
         
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2, default=str)
+        with open(filename, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
         
         return filename
 
+# トークン数の推定関数
+def estimate_token_count(text: str) -> int:
+    """
+    UTF-8のバイト長からトークン数を推定
+    日本語は1文字3バイトでおおむね1トークンとなるため、空白分割より実態に近い値になる
+    """
+    return len(text.encode("utf-8")) // 3
+
 # BLEU スコア計算関数
 def calculate_bleu_score(reference: str, hypothesis: str) -> float:
     """
@@ -184,27 +248,23 @@ def calculate_bleu_score(reference: str, hypothesis: str) -> float:
     実際のプロダクションでは、sacrebleu等の専用ライブラリを使用推奨
     """
     try:
-        # 文字レベルのn-gramでBLEU計算（簡易版）
-        import re
-        
-        # 前処理
-        ref_tokens = list(reference.lower().strip())
-        hyp_tokens = list(hypothesis.lower().strip())
+        # 文字レベルの1-gramでBLEU計算（簡易版）
+        ref_text = reference.lower().strip()
+        hyp_text = hypothesis.lower().strip()
         
-        if not ref_tokens or not hyp_tokens:
+        if not ref_text or not hyp_text:
             return 0.0
         
-        # 1-gramの一致率を計算
-        ref_1gram = set(ref_tokens)
-        hyp_1gram = set(hyp_tokens)
-        
-        if not hyp_1gram:
-            return 0.0
+        # 完全一致の場合は集計不要
+        if ref_text == hyp_text:
+            return 1.0
         
-        precision = len(ref_1gram.intersection(hyp_1gram)) / len(hyp_1gram)
+        # 1-gramの修正適合率（参照文の出現回数でクリップした一致数）
+        clipped_matches = sum((Counter(ref_text) & Counter(hyp_text)).values())
+        precision = clipped_matches / len(hyp_text)
         
         # 長さペナルティ
-        length_penalty = min(1.0, len(hyp_tokens) / len(ref_tokens))
+        length_penalty = min(1.0, len(hyp_text) / len(ref_text))
         
         # 簡易BLEU スコア
         bleu = precision * length_penalty
@@ -5,9 +5,18 @@ LangGraph + LangChain を使用したRAG処理エージェント
 """
 
 import asyncio
-from typing import Dict, List, Any, Optional
+import functools
+import hashlib
+import itertools
+from collections import OrderedDict
+from operator import itemgetter
+from typing import Dict, List, Any, AsyncGenerator, Iterable, Optional
 import json
 
+import orjson
+
+from semantic_cache import SemanticCache
+
 # 新しいモジュール構造からインポート
 try:
     from tools import web_search_tool, web_search_function  # 新しいツールモジュール
@@ -26,6 +35,25 @@ except ImportError as e:
     NEW_MODULES_AVAILABLE = False
 
 
+# システムメッセージの固定部分（検索結果はこの後ろに連結するため、KVキャッシュを再利用できる）
+_SYSTEM_PROMPT_PREFIX = (
+    "あなたは日本語で応答する親切なAIアシスタントです。\n"
+    "以下の検索結果を参考にして、ユーザーの質問に正確で有用な回答を提供してください。\n"
+    "検索結果に関連する情報がない場合は、一般的な知識で回答してください。\n\n"
+    "検索結果:\n"
+)
+_SYSTEM_PROMPT_TMPL = _SYSTEM_PROMPT_PREFIX + "{context}"
+
+# システムプロンプトのプレフィル時の生成オプション（プレフィルのみ行い、生成は1トークンで止める）
+PRIME_OPTIONS = {"num_predict": 1}
+
+# 再利用するシステムメッセージの最大保持数
+SYSTEM_MESSAGE_CACHE_SIZE = 64
+
+# コンテキストに埋め込む検索結果1件分のテンプレート
+_CONTEXT_ITEM_TMPL = "\n検索結果 {i}:\nタイトル: {title}\nURL: {url}\n内容: {snippet}\n"
+
+
 # 後方互換性のため、新しいモジュールが利用できない場合のフォールバック実装
 if not NEW_MODULES_AVAILABLE:
     class SimpleOllamaLLM:
@@ -34,69 +62,137 @@ if not NEW_MODULES_AVAILABLE:
         def __init__(self, model_name: str = "qwen3:30b", base_url: str = "http://localhost:11434"):
             self.model_name = model_name
             self.base_url = base_url
+            self._client: Optional[httpx.AsyncClient] = None
+        
+        async def _get_client(self) -> httpx.AsyncClient:
+            """共有HTTPクライアントを取得（初回呼び出し時に生成し、以降は再利用）"""
+            if self._client is None:
+                self._client = httpx.AsyncClient(
+                    base_url=self.base_url,
+                    timeout=httpx.Timeout(30.0),
+                    limits=httpx.Limits(max_keepalive_connections=32, max_connections=64)
+                )
+            return self._client
+        
+        async def close(self):
+            """共有HTTPクライアントを閉じる"""
+            if self._client is not None:
+                await self._client.aclose()
+                self._client = None
         
-        async def generate_response(self, messages: List[Dict[str, str]]) -> str:
-            """非同期でOllamaからレスポンスを生成"""
+        async def stream_response(self,
+                                  messages: Iterable[Dict[str, str]],
+                                  options: Optional[Dict[str, Any]] = None) -> AsyncGenerator[str, None]:
+            """非同期でOllamaからトークンを順次取得"""
+            payload = {
+                "model": self.model_name,
+                "messages": list(messages),
+                "stream": True
+            }
+            if options:
+                payload["options"] = options
+            
             try:
-                async with httpx.AsyncClient() as client:
-                    response = await client.post(
-                        f"{self.base_url}/api/chat",
-                        json={
-                            "model": self.model_name,
-                            "messages": messages,
-                            "stream": False
-                        },
-                        timeout=30.0
-                    )
-                    
+                client = await self._get_client()
+                
+                async with client.stream(
+                    "POST",
+                    "/api/chat",
+                    content=orjson.dumps(payload),
+                    headers={"Content-Type": "application/json"},
+                    # 生成中のトークン間隔は読み取りタイムアウトの対象外とする
+                    timeout=httpx.Timeout(30.0, connect=5.0, read=None)
+                ) as response:
                     if response.status_code != 200:
                         raise Exception(f"Ollama API エラー: {response.status_code}")
                     
-                    result = response.json()
-                    return result["message"]["content"]
+                    async for line in response.aiter_lines():
+                        if not line:
+                            continue
+                        try:
+                            data = orjson.loads(line)
+                        except orjson.JSONDecodeError:
+                            continue
+                        
+                        content = data.get("message", {}).get("content")
+                        if content:
+                            yield content
+                        if data.get("done", False):
+                            break
                     
             except Exception as e:
                 raise Exception(f"LLM生成エラー: {str(e)}")
+        
+        async def generate_response(self,
+                                    messages: Iterable[Dict[str, str]],
+                                    options: Optional[Dict[str, Any]] = None) -> str:
+            """非同期でOllamaからレスポンスを生成（ストリーミングで受信して連結）"""
+            return "".join([token async for token in self.stream_response(messages, options)])
+
+    _get_result_fields = itemgetter("title", "href", "body")
+
+    def _normalize_results(raw_results: Iterable[Dict]) -> List[Dict]:
+        """DDGSの検索結果をtitle/url/snippet形式に整形"""
+        normalized = []
+        for result in raw_results:
+            try:
+                title, url, snippet = _get_result_fields(result)
+            except KeyError:
+                title, url, snippet = result.get("title"), result.get("href"), result.get("body")
+            normalized.append({"title": title or "", "url": url or "", "snippet": snippet or ""})
+        return normalized
+
+    def _search_sync(query: str, max_results: int) -> List[Dict]:
+        """DDGSで同期的に検索し結果を整形（asyncio.to_thread 経由で呼び出す）"""
+        # スレッドごとに独立したDDGSインスタンスを使用
+        return _normalize_results(DDGS().text(query, max_results=max_results))
 
     async def web_search_function(query: str, max_results: int = 5) -> List[Dict]:
         """Web検索関数（フォールバック）"""
+        # 日本語指定の検索と指定なしの検索を同時に開始し、日本語の結果を優先する
+        ja_task = asyncio.create_task(asyncio.to_thread(_search_sync, f"{query} lang:ja", max_results))
+        fallback_task = asyncio.create_task(asyncio.to_thread(_search_sync, query, max_results))
         try:
-            search_query = f"{query} lang:ja"
-            results = []
-            
-            with DDGS() as ddgs:
-                for result in ddgs.text(search_query, max_results=max_results):
-                    results.append({
-                        "title": result.get("title", ""),
-                        "url": result.get("href", ""),
-                        "snippet": result.get("body", "")
-                    })
-            
-            if not results:
-                with DDGS() as ddgs:
-                    for result in ddgs.text(query, max_results=max_results):
-                        results.append({
-                            "title": result.get("title", ""),
-                            "url": result.get("href", ""),
-                            "snippet": result.get("body", "")
-                        })
-            
-            return results
+            results = await ja_task
+            if results:
+                fallback_task.cancel()
+                return results
+            
+            return await fallback_task
             
         except Exception as e:
+            fallback_task.cancel()
             return [{"title": "検索エラー", "url": "", "snippet": f"検索中にエラーが発生しました: {str(e)}"}]
 
 
 class SimpleRAGAgent:
     """シンプルなRAG処理エージェント（LangGraphを使わない直接実装）"""
     
+    SYSTEM_PROMPT_PREFIX = _SYSTEM_PROMPT_PREFIX
+    
     def __init__(self):
+        self._system_primed = False
+        self._warmup_task: Optional[asyncio.Task] = None
+        # Ollamaの死活確認が済んでいるかどうか（初回のみ検索と並行して確認する）
+        self._ollama_checked = False
+        # コンテキストのハッシュ → システムメッセージ（同一内容なら同じバイト列を送る）
+        self._system_message_cache: "OrderedDict[bytes, Dict[str, str]]" = OrderedDict()
+        
         # 新しいモジュール構造を使用
         if NEW_MODULES_AVAILABLE:
             self.llm = SimpleLLMClient()
         else:
             self.llm = SimpleOllamaLLM()
         
+        # 回答キャッシュ（完全一致 → 埋め込み類似度の2段階）
+        # 検索結果の鮮度はTTLで担保する
+        self.answer_cache = SemanticCache(
+            embed_function=self.llm.client.generate_embedding if NEW_MODULES_AVAILABLE else None,
+            similarity_threshold=0.92,
+            ttl=3600.0,
+            max_entries=1024
+        )
+        
         # 高度なパイプラインが利用可能な場合は初期化
         if ADVANCED_PIPELINE_AVAILABLE:
             self.advanced_pipeline = AdvancedRAGPipeline()
@@ -110,66 +206,172 @@ class SimpleRAGAgent:
             self.thinking_callback_manager = None
             self.thinking_integration = None
     
-    async def process_message(self, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """メッセージを処理してレスポンスを生成"""
+    async def _prime_system_prompt(self):
+        """
+        システムプロンプトの固定部分だけを送信してプレフィルを行う（失敗しても本処理には影響させない）
+        
+        生成は1トークンで打ち切り、本来の応答生成がウォームアップの完了待ちで遅れないようにする
+        """
+        try:
+            await self.llm.generate_response([
+                {"role": "system", "content": self.SYSTEM_PROMPT_PREFIX},
+                {"role": "user", "content": "ok"}
+            ], options=PRIME_OPTIONS)
+        except Exception as e:
+            print(f"システムプロンプトのウォームアップに失敗: {e}")
+    
+    def _get_system_message(self, context: str) -> Dict[str, str]:
+        """
+        コンテキストに対応するシステムメッセージを取得
+        
+        同じ検索結果が続く場合は生成済みの辞書を再利用する（呼び出し側で変更しないこと）
+        """
+        key = hashlib.blake2b(context.encode("utf-8"), digest_size=16).digest()
+        system_message = self._system_message_cache.get(key)
+        if system_message is not None:
+            self._system_message_cache.move_to_end(key)
+            return system_message
+        
+        system_message = {
+            "role": "system",
+            "content": _SYSTEM_PROMPT_TMPL.format(context=context)
+        }
+        self._system_message_cache[key] = system_message
+        if len(self._system_message_cache) > SYSTEM_MESSAGE_CACHE_SIZE:
+            self._system_message_cache.popitem(last=False)
+        return system_message
+    
+    async def process_message_stream(self,
+                                     messages: List[Dict[str, Any]],
+                                     no_cache: bool = False) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        メッセージを処理し、進行状況と生成トークンを順次返す
+        
+        Args:
+            messages: メッセージのリスト
+            no_cache: 回答キャッシュを使用しない場合はTrue
+            
+        Yields:
+            {"stage": "search", ...} → {"stage": "token", "delta": ...} × N → {"stage": "done", ...}
+            エラー時は {"stage": "error", ...}
+        """
+        search_task: Optional[asyncio.Task] = None
         try:
             # 1. 検索フェーズ
             last_message = messages[-1] if messages else {}
             query = last_message.get("content", "")
             
             if not query:
-                return {
-                    "success": False,
+                yield {
+                    "stage": "error",
                     "error": "メッセージが空です",
                     "response": "質問を入力してください。"
                 }
+                return
             
-            # Web検索を実行（新しいモジュール構造対応）
-            search_results = await web_search_function(query)
+            # Web検索を先に開始し、キャッシュ参照等の待ち時間と重ねる（新しいモジュール構造対応）
+            search_task = asyncio.create_task(web_search_function(query))
             
-            # 2. コンテキスト化フェーズ
-            context_parts = []
-            for i, result in enumerate(search_results[:3], 1):  # 上位3件
-                context_parts.append(f"""
-検索結果 {i}:
-タイトル: {result.get('title', 'N/A')}
-URL: {result.get('url', 'N/A')}
-内容: {result.get('snippet', 'N/A')}
-""")
+            # 会話履歴に依存しない単発の質問のみ回答キャッシュを使用
+            use_cache = not no_cache and len(messages) == 1
+            if use_cache:
+                cached = await self.answer_cache.lookup("rag", query)
+                if cached is not None:
+                    search_task.cancel()
+                    yield {
+                        "stage": "search",
+                        "search_results": cached["search_results"],
+                        "context": cached["context"]
+                    }
+                    yield {"stage": "done", "response": cached["response"], "cached": True}
+                    return
+            
+            # 検索中にシステムプロンプトのプレフィルを済ませ、OllamaのKVキャッシュを温めておく
+            if not self._system_primed:
+                self._system_primed = True
+                self._warmup_task = asyncio.create_task(self._prime_system_prompt())
+            
+            if not self._ollama_checked and NEW_MODULES_AVAILABLE:
+                # 初回はOllamaの死活確認を検索と並行して行い、停止中なら検索完了を待たずに失敗させる
+                # （検索タスクは finally でキャンセルされる）
+                if not await self.llm.client.health_check():
+                    raise Exception("Ollamaサーバーに接続できません")
+                self._ollama_checked = True
             
-            context = "\n".join(context_parts)
+            search_results = await search_task
+            
+            # 2. コンテキスト化フェーズ
+            # 上位3件を1回の走査で整形して連結
+            context = "\n".join([
+                _CONTEXT_ITEM_TMPL.format(
+                    i=i,
+                    title=result.get('title', 'N/A'),
+                    url=result.get('url', 'N/A'),
+                    snippet=result.get('snippet', 'N/A')
+                )
+                for i, result in enumerate(search_results[:3], 1)
+            ])
+            yield {"stage": "search", "search_results": search_results, "context": context}
             
             # 3. 生成フェーズ
             # システムプロンプトを含むメッセージを構築
-            system_message = {
-                "role": "system",
-                "content": f"""あなたは日本語で応答する親切なAIアシスタントです。
-以下の検索結果を参考にして、ユーザーの質問に正確で有用な回答を提供してください。
-検索結果に関連する情報がない場合は、一般的な知識で回答してください。
-
-検索結果:
-{context}"""
-            }
+            system_message = self._get_system_message(context)
             
-            # メッセージを構築
-            llm_messages = [system_message] + messages
+            # メッセージを構築（リストの複製はLLMクライアント側で一度だけ行う）
+            llm_messages = itertools.chain((system_message,), messages)
             
-            # LLMで応答生成
-            response = await self.llm.generate_response(llm_messages)
+            # LLMの応答をトークン単位で中継
+            response_parts = []
+            async for token in self.llm.stream_response(llm_messages):
+                response_parts.append(token)
+                yield {"stage": "token", "delta": token}
+            response = "".join(response_parts)
             
-            return {
-                "success": True,
-                "response": response,
-                "search_results": search_results,
-                "context": context
-            }
+            if use_cache:
+                await self.answer_cache.store("rag", query, {
+                    "response": response,
+                    "search_results": search_results,
+                    "context": context
+                })
+            
+            yield {"stage": "done", "response": response}
             
         except Exception as e:
-            return {
-                "success": False,
+            yield {
+                "stage": "error",
                 "error": str(e),
                 "response": "申し訳ございません。処理中にエラーが発生しました。"
             }
+        finally:
+            # 途中で終了した場合に検索タスクを残さない
+            if search_task is not None and not search_task.done():
+                search_task.cancel()
+    
+    async def process_message(self, messages: List[Dict[str, Any]], no_cache: bool = False) -> Dict[str, Any]:
+        """
+        メッセージを処理してレスポンスを生成（process_message_stream の結果をまとめて返す）
+        
+        Args:
+            messages: メッセージのリスト
+            no_cache: 回答キャッシュを使用しない場合はTrue
+        """
+        result: Dict[str, Any] = {}
+        async for event in self.process_message_stream(messages, no_cache=no_cache):
+            stage = event["stage"]
+            if stage == "search":
+                result["search_results"] = event["search_results"]
+                result["context"] = event["context"]
+            elif stage == "done":
+                result = {"success": True, "response": event["response"], **result}
+                if event.get("cached"):
+                    result["cached"] = True
+            elif stage == "error":
+                return {
+                    "success": False,
+                    "error": event["error"],
+                    "response": event["response"]
+                }
+        return result
     
     async def process_message_with_thinking(self, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
         """高度なパイプラインを使用してメッセージを処理（思考プロセス付き）"""
@@ -213,5 +415,14 @@ else:
     web_search_tool = web_search_function
 
 
-# グローバルエージェントインスタンス
-rag_agent = SimpleRAGAgent() 
\ No newline at end of file
+@functools.lru_cache(maxsize=1)
+def get_rag_agent() -> SimpleRAGAgent:
+    """グローバルエージェントインスタンスを取得（初回呼び出し時に生成）"""
+    return SimpleRAGAgent()
+
+
+def __getattr__(name: str) -> Any:
+    """後方互換性のため、rag_agent は初回アクセス時に生成する"""
+    if name == "rag_agent":
+        return get_rag_agent()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -4,11 +4,51 @@
 """
 
 import asyncio
-import json
-from typing import Dict, List, Any, AsyncGenerator, Optional
+import functools
+from typing import Dict, List, Any, AsyncGenerator, Iterable, Optional
 import httpx
+import orjson
 from pathlib import Path
 
+from http_client import get_shared_client, close_shared_client
+
+# リクエストボディはorjsonで直接バイト列にシリアライズして送信する
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+class OllamaError(Exception):
+    """Ollamaとの通信・応答処理のエラー"""
+
+
+class OllamaAPIError(OllamaError):
+    """Ollama APIがエラーステータスを返した場合のエラー"""
+    
+    def __init__(self, status: int, body: str = ""):
+        super().__init__(f"Ollama API エラー: {status}")
+        self.status = status
+        self.body = body
+
+
+# OllamaError に変換する下位レイヤーの例外（通信エラーと応答形式の不正）
+_WRAPPED_ERRORS = (httpx.HTTPError, KeyError, TypeError, ValueError)
+
+
+DEFAULT_SYSTEM_PROMPT = "あなたは日本語で応答する親切なAIアシスタントです。質問に対して正確で有用な回答を提供してください。"
+
+
+@functools.lru_cache(maxsize=1)
+def _default_system_prompt() -> str:
+    """デフォルトシステムプロンプトを読み込み（プロセス内で一度だけファイルを読む）"""
+    try:
+        prompt_path = Path("prompts/system_prompt.txt")
+        if prompt_path.exists():
+            return prompt_path.read_text(encoding="utf-8")
+        else:
+            return DEFAULT_SYSTEM_PROMPT
+    except Exception as e:
+        print(f"システムプロンプトの読み込みエラー: {e}")
+        return DEFAULT_SYSTEM_PROMPT
+
 
 class OllamaLLMClient:
     """統一されたOllama LLMクライアント"""
@@ -16,28 +56,69 @@ class OllamaLLMClient:
     def __init__(self, 
                  model_name: str = "qwen3:30b", 
                  base_url: str = "http://localhost:11434",
-                 timeout: float = 30.0):
+                 timeout: float = 30.0,
+                 client: Optional[httpx.AsyncClient] = None):
+        """
+        Args:
+            client: 使用するHTTPクライアント（Noneの場合はプロセス共有のクライアントを使用）
+        """
         self.model_name = model_name
         self.base_url = base_url
         self.timeout = timeout
-        self.default_system_prompt = self._load_default_system_prompt()
+        # 指定されたクライアントを閉じるかどうかは呼び出し側の責任とする
+        self._client: Optional[httpx.AsyncClient] = client
+        # モデル情報はプロセス中に変化しないため、取得に成功した結果を保持する
+        self._model_info: Optional[Dict[str, Any]] = None
+        self._model_info_lock = asyncio.Lock()
     
-    def _load_default_system_prompt(self) -> str:
-        """デフォルトシステムプロンプトを読み込み"""
-        try:
-            prompt_path = Path("prompts/system_prompt.txt")
-            if prompt_path.exists():
-                return prompt_path.read_text(encoding="utf-8")
-            else:
-                return "あなたは日本語で応答する親切なAIアシスタントです。質問に対して正確で有用な回答を提供してください。"
-        except Exception as e:
-            print(f"システムプロンプトの読み込みエラー: {e}")
-            return "あなたは日本語で応答する親切なAIアシスタントです。質問に対して正確で有用な回答を提供してください。"
+    async def _get_client(self) -> httpx.AsyncClient:
+        """HTTPクライアントを取得（未指定の場合はプロセス共有のクライアント）"""
+        if self._client is None:
+            self._client = await get_shared_client()
+        return self._client
+    
+    async def _post(self, path: str, payload: Dict[str, Any], timeout: Optional[float] = None) -> httpx.Response:
+        """共有クライアントでOllama APIにPOSTし、ステータスを確認してレスポンスを返す"""
+        client = await self._get_client()
+        response = await client.post(
+            f"{self.base_url}{path}",
+            content=orjson.dumps(payload),
+            headers=JSON_HEADERS,
+            timeout=timeout if timeout is not None else self.timeout
+        )
+        if response.status_code != 200:
+            raise OllamaAPIError(response.status_code, response.text)
+        return response
+    
+    async def aclose(self):
+        """
+        HTTPクライアントへの参照を解放
+        
+        クライアントは他のインスタンスと共有されているためここでは閉じない。
+        接続の終了は close_llm_clients() で行う
+        """
+        self._client = None
+    
+    async def __aenter__(self) -> "OllamaLLMClient":
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+    
+    @functools.cached_property
+    def default_system_prompt(self) -> str:
+        """デフォルトシステムプロンプト（初回参照時にのみ読み込み）"""
+        return _default_system_prompt()
+    
+    def get_system_prompt(self) -> str:
+        """デフォルトシステムプロンプトを取得"""
+        return self.default_system_prompt
     
     async def generate_response(self, 
-                              messages: List[Dict[str, str]], 
+                              messages: Iterable[Dict[str, str]], 
                               system_prompt: Optional[str] = None,
-                              include_system: bool = True) -> str:
+                              include_system: bool = True,
+                              options: Optional[Dict[str, Any]] = None) -> str:
         """
         通常の応答を生成
         
@@ -45,38 +126,36 @@ class OllamaLLMClient:
             messages: メッセージのリスト
             system_prompt: カスタムシステムプロンプト（Noneの場合はデフォルトを使用）
             include_system: システムプロンプトを含めるかどうか
+            options: Ollamaの生成オプション（例: {"num_predict": 1}）
             
         Returns:
             生成された応答文字列
+            
+        Raises:
+            OllamaError: 通信エラーまたは不正な応答の場合
         """
+        # メッセージを準備
+        ollama_messages = self._prepare_messages(messages, system_prompt, include_system)
+        
+        payload = {
+            "model": self.model_name,
+            "messages": ollama_messages,
+            "stream": False
+        }
+        if options:
+            payload["options"] = options
+        
         try:
-            # メッセージを準備
-            ollama_messages = self._prepare_messages(messages, system_prompt, include_system)
-            
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{self.base_url}/api/chat",
-                    json={
-                        "model": self.model_name,
-                        "messages": ollama_messages,
-                        "stream": False
-                    },
-                    timeout=self.timeout
-                )
-                
-                if response.status_code != 200:
-                    raise Exception(f"Ollama API エラー: {response.status_code}")
-                
-                result = response.json()
-                return result["message"]["content"]
-                
-        except Exception as e:
-            raise Exception(f"LLM生成エラー: {str(e)}")
+            response = await self._post("/api/chat", payload)
+            return orjson.loads(response.content)["message"]["content"]
+        except _WRAPPED_ERRORS as e:
+            raise OllamaError(f"LLM生成エラー: {e}") from e
     
     async def stream_response(self, 
-                            messages: List[Dict[str, str]], 
+                            messages: Iterable[Dict[str, str]], 
                             system_prompt: Optional[str] = None,
-                            include_system: bool = True) -> AsyncGenerator[str, None]:
+                            include_system: bool = True,
+                            model_name: Optional[str] = None) -> AsyncGenerator[str, None]:
         """
         ストリーミング応答を生成
         
@@ -84,75 +163,110 @@ class OllamaLLMClient:
             messages: メッセージのリスト
             system_prompt: カスタムシステムプロンプト
             include_system: システムプロンプトを含めるかどうか
+            model_name: 使用するモデル名（Noneの場合は既定のモデル）
             
         Yields:
             生成されたトークンの文字列
+            
+        Raises:
+            OllamaError: 通信エラーまたは不正な応答の場合
         """
+        # メッセージを準備
+        ollama_messages = self._prepare_messages(messages, system_prompt, include_system)
+        
         try:
-            # メッセージを準備
-            ollama_messages = self._prepare_messages(messages, system_prompt, include_system)
-            
-            async with httpx.AsyncClient() as client:
-                async with client.stream(
-                    "POST",
-                    f"{self.base_url}/api/chat",
-                    json={
-                        "model": self.model_name,
-                        "messages": ollama_messages,
-                        "stream": True
-                    },
-                    timeout=self.timeout
-                ) as response:
-                    if response.status_code != 200:
-                        raise Exception(f"Ollama API エラー: {response.status_code}")
-                    
-                    async for line in response.aiter_lines():
-                        if line:
-                            try:
-                                data = json.loads(line)
-                                if "message" in data and "content" in data["message"]:
-                                    content = data["message"]["content"]
-                                    if content:
-                                        yield content
-                                
-                                # ストリーミング完了を確認
-                                if data.get("done", False):
-                                    break
-                                    
-                            except json.JSONDecodeError:
-                                continue
+            client = await self._get_client()
+            async with client.stream(
+                "POST",
+                f"{self.base_url}/api/chat",
+                content=orjson.dumps({
+                    "model": model_name or self.model_name,
+                    "messages": ollama_messages,
+                    "stream": True
+                }),
+                headers=JSON_HEADERS,
+                # 生成中のトークン間隔は読み取りタイムアウトの対象外とする
+                timeout=httpx.Timeout(self.timeout, connect=5.0, read=None)
+            ) as response:
+                if response.status_code != 200:
+                    body = await response.aread()
+                    raise OllamaAPIError(response.status_code, body.decode("utf-8", "replace"))
+                
+                # NDJSONをバイト列のまま行分割し、orjsonで解析する
+                buf = bytearray()
+                async for chunk in response.aiter_bytes():
+                    buf.extend(chunk)
+                    while (newline := buf.find(b"\n")) != -1:
+                        line = bytes(buf[:newline])
+                        del buf[:newline + 1]
+                        if not line:
+                            continue
+                        try:
+                            data = orjson.loads(line)
+                        except orjson.JSONDecodeError:
+                            continue
+                        
+                        message = data.get("message")
+                        if message and (content := message.get("content")):
+                            yield content
+                        
+                        # ストリーミング完了を確認
+                        if data.get("done", False):
+                            return
                                 
-        except Exception as e:
-            raise Exception(f"ストリーミング生成エラー: {str(e)}")
+        except _WRAPPED_ERRORS as e:
+            raise OllamaError(f"ストリーミング生成エラー: {e}") from e
+    
+    async def generate_embedding(self, 
+                                 text: str, 
+                                 model_name: str = "nomic-embed-text") -> List[float]:
+        """
+        テキストの埋め込みベクトルを生成
+        
+        Args:
+            text: 埋め込み対象のテキスト
+            model_name: 埋め込みモデル名
+            
+        Returns:
+            埋め込みベクトル
+            
+        Raises:
+            OllamaError: 通信エラーまたは不正な応答の場合
+        """
+        try:
+            response = await self._post("/api/embeddings", {
+                "model": model_name,
+                "prompt": text
+            })
+            return orjson.loads(response.content)["embedding"]
+        except _WRAPPED_ERRORS as e:
+            raise OllamaError(f"埋め込み生成エラー: {e}") from e
     
     def _prepare_messages(self, 
-                         messages: List[Dict[str, str]], 
+                         messages: Iterable[Dict[str, str]], 
                          system_prompt: Optional[str] = None,
                          include_system: bool = True) -> List[Dict[str, str]]:
         """
         Ollama用のメッセージフォーマットを準備
         
         Args:
-            messages: 元のメッセージリスト
+            messages: 元のメッセージ（リストまたは任意のイテラブル）
             system_prompt: カスタムシステムプロンプト
             include_system: システムプロンプトを含めるかどうか
+                （先頭が既にシステムメッセージの場合は追加しない）
             
         Returns:
             Ollama用にフォーマットされたメッセージリスト
         """
-        ollama_messages = []
+        # 送信用のリストはここで一度だけ構築する
+        ollama_messages = list(messages)
         
-        # システムプロンプトを追加
-        if include_system:
+        # 呼び出し側が既にシステムメッセージを先頭に置いている場合は重複させない
+        # （デフォルトプロンプトの読み込みも発生しない）
+        if include_system and not (ollama_messages and ollama_messages[0].get("role") == "system"):
             prompt = system_prompt if system_prompt is not None else self.default_system_prompt
             if prompt:
-                ollama_messages.append({
-                    "role": "system",
-                    "content": prompt
-                })
-        
-        # 既存のメッセージを追加
-        ollama_messages.extend(messages)
+                ollama_messages.insert(0, {"role": "system", "content": prompt})
         
         return ollama_messages
     
@@ -164,73 +278,130 @@ class OllamaLLMClient:
             サーバーが利用可能かどうか
         """
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(f"{self.base_url}/api/version", timeout=5.0)
-                return response.status_code == 200
+            client = await self._get_client()
+            response = await client.get(f"{self.base_url}/api/version", timeout=5.0)
+            return response.status_code == 200
         except:
             return False
     
     async def get_model_info(self) -> Dict[str, Any]:
         """
-        使用中のモデル情報を取得
+        使用中のモデル情報を取得（取得に成功した結果はキャッシュする）
         
         Returns:
             モデル情報の辞書
         """
+        if self._model_info is not None:
+            return self._model_info
+        
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{self.base_url}/api/show",
-                    json={"name": self.model_name},
-                    timeout=10.0
-                )
-                
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    return {"error": f"モデル情報取得エラー: {response.status_code}"}
-                    
+            async with self._model_info_lock:
+                if self._model_info is None:
+                    response = await self._post("/api/show", {"name": self.model_name}, timeout=10.0)
+                    self._model_info = orjson.loads(response.content)
+            return self._model_info
+            
         except Exception as e:
             return {"error": f"モデル情報取得エラー: {str(e)}"}
+    
+    def invalidate_model_info(self):
+        """キャッシュしたモデル情報を破棄（モデルを再取得した場合などに呼び出す）"""
+        self._model_info = None
 
 
 class SimpleLLMClient:
     """シンプルなLLMクライアント（後方互換性用）"""
     
-    def __init__(self, model_name: str = "qwen3:30b", base_url: str = "http://localhost:11434"):
-        self.client = OllamaLLMClient(model_name, base_url)
+    def __init__(self,
+                 model_name: str = "qwen3:30b",
+                 base_url: str = "http://localhost:11434",
+                 client: Optional[httpx.AsyncClient] = None):
+        self.client = OllamaLLMClient(model_name, base_url, client=client)
     
-    async def generate_response(self, messages: List[Dict[str, str]]) -> str:
+    async def generate_response(self,
+                                messages: Iterable[Dict[str, str]],
+                                options: Optional[Dict[str, Any]] = None) -> str:
         """後方互換性のための簡単なインターフェース"""
-        return await self.client.generate_response(messages)
+        return await self.client.generate_response(messages, options=options)
+    
+    async def stream_response(self, messages: Iterable[Dict[str, str]]) -> AsyncGenerator[str, None]:
+        """後方互換性のための簡単なストリーミングインターフェース"""
+        async for token in self.client.stream_response(messages):
+            yield token
+    
+    async def aclose(self):
+        """内部のLLMクライアントを閉じる"""
+        await self.client.aclose()
+
 
+# グローバルインスタンス（初回呼び出し時に生成）
+@functools.lru_cache(maxsize=1)
+def get_default_llm_client() -> OllamaLLMClient:
+    """デフォルトのLLMクライアントを取得"""
+    return OllamaLLMClient()
 
-# グローバルインスタンス
-default_llm_client = OllamaLLMClient()
-simple_llm_client = SimpleLLMClient()
+
+@functools.lru_cache(maxsize=8)
+def get_llm_client(model_name: str) -> OllamaLLMClient:
+    """
+    モデルごとのLLMクライアントを取得
+    
+    呼び出しのたびにモデルを切り替えるのは避け、用途ごとに固定のモデルを使うこと
+    """
+    if model_name == get_default_llm_client().model_name:
+        return get_default_llm_client()
+    return OllamaLLMClient(model_name)
+
+
+@functools.lru_cache(maxsize=1)
+def get_simple_llm_client() -> SimpleLLMClient:
+    """後方互換性用のシンプルなLLMクライアントを取得"""
+    return SimpleLLMClient()
+
+
+def __getattr__(name: str) -> Any:
+    """後方互換性のため、グローバルインスタンスは初回アクセス時に生成する"""
+    if name == "default_llm_client":
+        return get_default_llm_client()
+    if name == "simple_llm_client":
+        return get_simple_llm_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 # 便利な関数群
-async def generate_llm_response(messages: List[Dict[str, str]], 
+async def generate_llm_response(messages: Iterable[Dict[str, str]], 
                               model_name: str = "qwen3:30b",
-                              system_prompt: Optional[str] = None) -> str:
-    """簡単なLLM応答生成"""
-    client = OllamaLLMClient(model_name)
+                              system_prompt: Optional[str] = None,
+                              client: Optional[OllamaLLMClient] = None) -> str:
+    """簡単なLLM応答生成（client 未指定時はモデルごとの共有クライアントを使用）"""
+    if client is None:
+        client = get_llm_client(model_name)
     return await client.generate_response(messages, system_prompt)
 
 
-async def stream_llm_response(messages: List[Dict[str, str]], 
+async def stream_llm_response(messages: Iterable[Dict[str, str]], 
                             model_name: str = "qwen3:30b",
-                            system_prompt: Optional[str] = None) -> AsyncGenerator[str, None]:
-    """簡単なLLMストリーミング応答生成"""
-    client = OllamaLLMClient(model_name)
+                            system_prompt: Optional[str] = None,
+                            client: Optional[OllamaLLMClient] = None) -> AsyncGenerator[str, None]:
+    """簡単なLLMストリーミング応答生成（client 未指定時はモデルごとの共有クライアントを使用）"""
+    if client is None:
+        client = get_llm_client(model_name)
     async for token in client.stream_response(messages, system_prompt):
         yield token
 
 
 async def check_ollama_health() -> bool:
     """Ollamaサーバーのヘルスチェック"""
-    return await default_llm_client.health_check()
+    return await get_default_llm_client().health_check()
+
+
+async def close_llm_clients():
+    """LLMクライアントが共有する接続を閉じる（アプリケーション終了時に呼び出す）"""
+    await close_shared_client()
+    # 閉じた接続を参照するインスタンスを破棄し、次回アクセス時に作り直す
+    get_llm_client.cache_clear()
+    get_default_llm_client.cache_clear()
+    get_simple_llm_client.cache_clear()
 
 
 # エイリアス（後方互換性）
@@ -1,44 +1,94 @@
 import asyncio
-import json
-from typing import Dict, List, Optional
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Dict, List, Literal, Optional
 from fastapi import FastAPI, WebSocket, HTTPException, WebSocketDisconnect, Query
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict
 import uvicorn
 import httpx
+import orjson
 import time
+from ddgs import DDGS
+
+from http_client import get_shared_client, close_shared_client
 
 # 新しいモジュール構造に対応したインポート
 try:
     from langgraph_agent import rag_agent
     from streaming_agent import streaming_agent
-    from kpi_monitor import kpi_monitor, calculate_bleu_score
-    from thinking_parser import ThinkingParser
+    from kpi_monitor import kpi_monitor, calculate_bleu_score, estimate_token_count
+    from thinking_parser import ThinkingParser, parse_thinking_response
     from agent_pipeline import rag_pipeline
     from thinking_callback import thinking_callback_manager, ThinkingIntegration
     from tools import web_search_function  # 新しいツールモジュール
-    from llm import OllamaLLMClient  # 新しいLLMモジュール
+    from llm import get_llm_client, close_llm_clients  # 新しいLLMモジュール
     NEW_MODULES_AVAILABLE = True
 except ImportError as e:
     print(f"新しいモジュールのインポートエラー: {e}")
     # フォールバック用
     from langgraph_agent import rag_agent
     from streaming_agent import streaming_agent
-    from kpi_monitor import kpi_monitor, calculate_bleu_score
-    from thinking_parser import ThinkingParser
+    from kpi_monitor import kpi_monitor, calculate_bleu_score, estimate_token_count
+    from thinking_parser import ThinkingParser, parse_thinking_response
     from agent_pipeline import rag_pipeline
     from thinking_callback import thinking_callback_manager, ThinkingIntegration
     NEW_MODULES_AVAILABLE = False
 
+# KPI記録キューの上限（満杯時は記録を破棄し、応答を待たせない）
+KPI_QUEUE_SIZE = 10000
+
+async def _kpi_consumer(queue: asyncio.Queue):
+    """キューに積まれたKPI測定結果をバックグラウンドで記録"""
+    while True:
+        record = await queue.get()
+        try:
+            kpi_monitor.record_measurement(**record)
+        except Exception as e:
+            print(f"KPI記録エラー: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """アプリケーションのライフサイクル管理"""
+    # ブロッキングなDDGS検索を asyncio.to_thread で実行するためのスレッドプール
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=16))
+    # Ollamaとの通信に使う共有HTTPクライアント
+    app.state.http = await get_shared_client()
+    # KPI記録はキュー経由でバックグラウンドタスクが行う
+    app.state.kpi_queue = asyncio.Queue(maxsize=KPI_QUEUE_SIZE)
+    app.state.kpi_dropped = 0
+    kpi_task = asyncio.create_task(_kpi_consumer(app.state.kpi_queue))
+    yield
+    # 未処理のKPI測定結果を記録してから終了
+    kpi_task.cancel()
+    while not app.state.kpi_queue.empty():
+        kpi_monitor.record_measurement(**app.state.kpi_queue.get_nowait())
+    # 共有HTTPクライアントを閉じる
+    await rag_pipeline.close()
+    await streaming_agent.close()
+    if NEW_MODULES_AVAILABLE:
+        await close_llm_clients()
+    await close_shared_client()
+
 app = FastAPI(
     title="ゼロコストチャットアプリ",
     description="日本語対応のWebSearch付きチャットアプリ",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    # RESTレスポンスのシリアライズに orjson を使用
+    default_response_class=ORJSONResponse
 )
 
 # 思考分離パーサーの初期化
 thinking_parser = ThinkingParser()
 
+def format_thinking(response_text: str) -> Dict:
+    """応答から思考部分を分離し、フロントエンド用に整形（解析結果は parse_thinking_response がキャッシュする）"""
+    return thinking_parser.format_for_frontend(parse_thinking_response(response_text))
+
 # 思考コールバックの統合
 thinking_integration = ThinkingIntegration(rag_pipeline, thinking_callback_manager)
 
@@ -51,38 +101,34 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 検索結果を含むRESTレスポンスを圧縮（小さな応答は圧縮コストの方が大きいため対象外）
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 # リクエストモデル
 class ChatMessage(BaseModel):
-    role: str
+    # 未知のキーは無視し、生成後は変更しない
+    model_config = ConfigDict(extra="ignore", frozen=True)
+    
+    role: Literal["user", "assistant", "system"]
     content: str
 
 class ChatRequest(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    
     messages: List[ChatMessage]
 
 class ChatResponse(BaseModel):
     message: str
     timestamp: float
 
-# WebSocketマネージャー
-class WebSocketManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+# フォールバック時に付与するシステムプロンプト（リクエスト間で共有するため変更しないこと）
+SYSTEM_PROMPT_MESSAGE = {
+    "role": "system",
+    "content": "あなたは日本語で応答する親切なAIアシスタントです。質問に対して正確で有用な回答を提供してください。"
+}
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
-
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
-
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            await connection.send_text(message)
-
-manager = WebSocketManager()
+# リクエストボディはorjsonで直接バイト列にシリアライズして送信する
+JSON_HEADERS = {"Content-Type": "application/json"}
 
 # Ollamaとの通信関数
 async def call_ollama(messages: List[ChatMessage], model: str = "qwen3:30b") -> str:
@@ -90,9 +136,8 @@ async def call_ollama(messages: List[ChatMessage], model: str = "qwen3:30b") ->
     try:
         # 新しいモジュール構造を使用
         if NEW_MODULES_AVAILABLE:
-            llm_client = OllamaLLMClient(model_name=model)
-            ollama_messages = [{"role": msg.role, "content": msg.content} for msg in messages]
-            return await llm_client.generate_response(ollama_messages)
+            ollama_messages = [msg.model_dump() for msg in messages]
+            return await get_llm_client(model).generate_response(ollama_messages)
         else:
             # フォールバック実装
             return await _fallback_call_ollama(messages, model)
@@ -103,33 +148,26 @@ async def call_ollama(messages: List[ChatMessage], model: str = "qwen3:30b") ->
 async def _fallback_call_ollama(messages: List[ChatMessage], model: str = "qwen3:30b") -> str:
     """フォールバック用のOllama通信"""
     try:
-        # Ollamaのエンドポイントに送信するフォーマット
-        ollama_messages = [{"role": msg.role, "content": msg.content} for msg in messages]
+        # Ollamaのエンドポイントに送信するフォーマット（先頭にシステムプロンプトを付与）
+        ollama_messages = [SYSTEM_PROMPT_MESSAGE]
+        ollama_messages.extend(msg.model_dump() for msg in messages)
         
-        # システムプロンプトを追加
-        system_prompt = {
-            "role": "system",
-            "content": "あなたは日本語で応答する親切なAIアシスタントです。質問に対して正確で有用な回答を提供してください。"
-        }
+        response = await app.state.http.post(
+            "http://localhost:11434/api/chat",
+            content=orjson.dumps({
+                "model": model,
+                "messages": ollama_messages,
+                "stream": False
+            }),
+            headers=JSON_HEADERS,
+            timeout=30.0
+        )
         
-        ollama_messages.insert(0, system_prompt)
+        if response.status_code != 200:
+            raise HTTPException(status_code=500, detail="Ollama API エラー")
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "http://localhost:11434/api/chat",
-                json={
-                    "model": model,
-                    "messages": ollama_messages,
-                    "stream": False
-                },
-                timeout=30.0
-            )
-            
-            if response.status_code != 200:
-                raise HTTPException(status_code=500, detail="Ollama API エラー")
-            
-            result = response.json()
-            return result["message"]["content"]
+        result = response.json()
+        return result["message"]["content"]
             
     except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Ollama API タイムアウト")
@@ -158,36 +196,35 @@ async def search_web(query: str, max_results: int = 5) -> List[Dict]:
             }
         ]
 
+def _ddgs_search(query: str, max_results: int) -> List[Dict]:
+    """DDGSで同期的に検索し結果を整形（ブロッキングのため asyncio.to_thread 経由で呼び出す）"""
+    with DDGS() as ddgs:
+        return [
+            {
+                "title": result.get("title", ""),
+                "url": result.get("href", ""),
+                "snippet": result.get("body", "")
+            }
+            for result in ddgs.text(query, max_results=max_results)
+        ]
+
 async def _fallback_search_web(query: str, max_results: int = 5) -> List[Dict]:
     """フォールバック用のWeb検索"""
+    # イベントループを塞がないよう、検索はワーカースレッドで実行
+    # 日本語指定の検索と指定なしの検索を同時に開始し、日本語の結果を優先する
+    ja_task = asyncio.create_task(asyncio.to_thread(_ddgs_search, f"{query} lang:ja", max_results))
+    fallback_task = asyncio.create_task(asyncio.to_thread(_ddgs_search, query, max_results))
     try:
-        from ddgs import DDGS
-        
-        # 日本語検索を優先するようにクエリを調整
-        search_query = f"{query} lang:ja"
-        
-        results = []
-        with DDGS() as ddgs:
-            for result in ddgs.text(search_query, max_results=max_results):
-                results.append({
-                    "title": result.get("title", ""),
-                    "url": result.get("href", ""),
-                    "snippet": result.get("body", "")
-                })
+        results = await ja_task
+        if results:
+            fallback_task.cancel()
+            return results
         
-        # 検索結果がない場合は英語でも検索
-        if not results:
-            with DDGS() as ddgs:
-                for result in ddgs.text(query, max_results=max_results):
-                    results.append({
-                        "title": result.get("title", ""),
-                        "url": result.get("href", ""),
-                        "snippet": result.get("body", "")
-                    })
-        
-        return results
+        # 検索結果がない場合は指定なしの検索結果を使用
+        return await fallback_task
         
     except Exception as e:
+        fallback_task.cancel()
         print(f"Web検索エラー: {str(e)}")
         # エラー時はフォールバック
         return [
@@ -198,6 +235,14 @@ async def _fallback_search_web(query: str, max_results: int = 5) -> List[Dict]:
             }
         ]
 
+def record_kpi(**record):
+    """KPI測定結果をキューに追加（待機せずに戻る。満杯の場合は破棄して件数を数える）"""
+    record.setdefault("end_time", time.time())
+    try:
+        app.state.kpi_queue.put_nowait(record)
+    except asyncio.QueueFull:
+        app.state.kpi_dropped += 1
+
 # REST APIエンドポイント
 @app.post("/api/chat", response_model=ChatResponse)
 async def chat_endpoint(request: ChatRequest, debug: bool = Query(False, description="デバッグ情報を含める")):
@@ -207,7 +252,7 @@ async def chat_endpoint(request: ChatRequest, debug: bool = Query(False, descrip
     
     try:
         # メッセージを辞書形式に変換
-        messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
+        messages = request.model_dump()["messages"]
         
         # デバッグモードの場合は新しいパイプラインを使用
         if debug:
@@ -217,7 +262,7 @@ async def chat_endpoint(request: ChatRequest, debug: bool = Query(False, descrip
             if not result.get("success", False):
                 # エラーの場合のKPI記録
                 error_msg = result.get("error", "不明なエラー")
-                kpi_monitor.record_measurement(
+                record_kpi(
                     start_time=start_time,
                     token_count=0,
                     search_requests=0,
@@ -228,10 +273,10 @@ async def chat_endpoint(request: ChatRequest, debug: bool = Query(False, descrip
             
             # 成功の場合のKPI記録
             response_text = result["response"]
-            token_count = len(response_text.split())  # 簡易的なトークン数
+            token_count = estimate_token_count(response_text)  # 簡易的なトークン数
             search_count = len(result.get("search_results", []))
             
-            kpi_monitor.record_measurement(
+            record_kpi(
                 start_time=start_time,
                 token_count=token_count,
                 search_requests=search_count,
@@ -239,8 +284,7 @@ async def chat_endpoint(request: ChatRequest, debug: bool = Query(False, descrip
             )
             
             # 思考分離処理
-            parsed_response = thinking_parser.parse_response(response_text)
-            formatted_response = thinking_parser.format_for_frontend(parsed_response)
+            formatted_response = format_thinking(response_text)
             
             return {
                 "message": formatted_response["message"],
@@ -264,7 +308,7 @@ async def chat_endpoint(request: ChatRequest, debug: bool = Query(False, descrip
             if not result.get("success", False):
                 # エラーの場合のKPI記録
                 error_msg = result.get("error", "不明なエラー")
-                kpi_monitor.record_measurement(
+                record_kpi(
                     start_time=start_time,
                     token_count=0,
                     search_requests=0,
@@ -275,10 +319,10 @@ async def chat_endpoint(request: ChatRequest, debug: bool = Query(False, descrip
             
             # 成功の場合のKPI記録
             response_text = result["response"]
-            token_count = len(response_text.split())  # 簡易的なトークン数
+            token_count = estimate_token_count(response_text)  # 簡易的なトークン数
             search_count = len(result.get("search_results", []))
             
-            kpi_monitor.record_measurement(
+            record_kpi(
                 start_time=start_time,
                 token_count=token_count,
                 search_requests=search_count,
@@ -286,8 +330,7 @@ async def chat_endpoint(request: ChatRequest, debug: bool = Query(False, descrip
             )
             
             # 思考分離処理
-            parsed_response = thinking_parser.parse_response(response_text)
-            formatted_response = thinking_parser.format_for_frontend(parsed_response)
+            formatted_response = format_thinking(response_text)
             
             return {
                 "message": formatted_response["message"],
@@ -299,7 +342,7 @@ async def chat_endpoint(request: ChatRequest, debug: bool = Query(False, descrip
         
     except Exception as e:
         # 例外発生時のKPI記録
-        kpi_monitor.record_measurement(
+        record_kpi(
             start_time=start_time,
             token_count=0,
             search_requests=0,
@@ -312,21 +355,17 @@ async def chat_endpoint(request: ChatRequest, debug: bool = Query(False, descrip
 @app.websocket("/api/chat/ws")
 async def websocket_endpoint(websocket: WebSocket):
     """WebSocketでリアルタイムチャット"""
-    await manager.connect(websocket)
+    await websocket.accept()
     try:
         while True:
             # メッセージを受信
             data = await websocket.receive_text()
-            message_data = json.loads(data)
             
-            # ChatRequestとして解析
-            request = ChatRequest(**message_data)
+            # JSONの解析と検証を pydantic で一括して行い、辞書形式に変換
+            messages = ChatRequest.model_validate_json(data).model_dump()["messages"]
             
             # 応答を送信
-            await manager.send_personal_message("処理中...", websocket)
-            
-            # メッセージを辞書形式に変換
-            messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
+            await websocket.send_text("処理中...")
             
             # RAGエージェントでメッセージを処理
             result = await rag_agent.process_message(messages)
@@ -334,85 +373,74 @@ async def websocket_endpoint(websocket: WebSocket):
             if result.get("success", False):
                 # 思考分離処理
                 response_text = result.get("response", "応答を生成できませんでした")
-                parsed_response = thinking_parser.parse_response(response_text)
-                formatted_response = thinking_parser.format_for_frontend(parsed_response)
+                formatted_response = format_thinking(response_text)
                 
                 # 構造化されたレスポンスを送信
-                await manager.send_personal_message(
-                    json.dumps({
-                        "type": "message",
-                        "message": formatted_response["message"],
-                        "thinking": formatted_response["thinking"],
-                        "has_thinking": formatted_response["has_thinking"],
-                        "search_results": result.get("search_results", []),
-                        "timestamp": time.time()
-                    }, ensure_ascii=False),
-                    websocket
-                )
+                await websocket.send_bytes(orjson.dumps({
+                    "type": "message",
+                    "message": formatted_response["message"],
+                    "thinking": formatted_response["thinking"],
+                    "has_thinking": formatted_response["has_thinking"],
+                    "search_results": result.get("search_results", []),
+                    "timestamp": time.time()
+                }))
             else:
                 error_msg = result.get("error", "不明なエラー")
-                await manager.send_personal_message(
-                    json.dumps({
-                        "type": "error",
-                        "message": f"エラー: {error_msg}",
-                        "timestamp": time.time()
-                    }, ensure_ascii=False),
-                    websocket
-                )
+                await websocket.send_bytes(orjson.dumps({
+                    "type": "error",
+                    "message": f"エラー: {error_msg}",
+                    "timestamp": time.time()
+                }))
             
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
+        pass
+    except Exception as e:
+        await websocket.send_text(f"エラー: {str(e)}")
+
+# 生成側が送信側より先行できるフレーム数
+STREAM_QUEUE_SIZE = 64
+
+async def _produce_frames(queue: asyncio.Queue, frames):
+    """ストリーミングフレームをシリアライズしてキューに積む（終了時は None を積む）"""
+    try:
+        async for frame in frames:
+            await queue.put(orjson.dumps(frame))
     except Exception as e:
-        await manager.send_personal_message(f"エラー: {str(e)}", websocket)
+        await queue.put(orjson.dumps({"type": "error", "content": f"処理エラー: {str(e)}"}))
+    await queue.put(None)
 
 # WebSocketエンドポイント（ストリーミング）
 @app.websocket("/api/chat/stream")
 async def websocket_streaming_endpoint(websocket: WebSocket):
     """WebSocketでストリーミングチャット"""
-    await manager.connect(websocket)
+    await websocket.accept()
     try:
         while True:
             # メッセージを受信
             data = await websocket.receive_text()
-            message_data = json.loads(data)
             
-            # ChatRequestとして解析
-            request = ChatRequest(**message_data)
-            
-            # メッセージを辞書形式に変換
-            messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
+            # JSONの解析と検証を pydantic で一括して行い、辞書形式に変換
+            messages = ChatRequest.model_validate_json(data).model_dump()["messages"]
             
             # ストリーミングエージェントでメッセージを処理
-            response_chunks = []
-            async for chunk in streaming_agent.stream_response(messages):
-                # 通常のストリーミング処理
-                await manager.send_personal_message(json.dumps(chunk, ensure_ascii=False), websocket)
-                # 最終処理のために一時保存
-                if chunk.get("type") == "completed":
-                    response_chunks.append(chunk.get("content", ""))
-            
-            # 最終的な応答に対して思考分離処理
-            if response_chunks:
-                final_response = ''.join(response_chunks)
-                parsed_response = thinking_parser.parse_response(final_response)
-                if parsed_response.get("has_thinking"):
-                    # 思考が含まれている場合は、思考情報を送信
-                    await manager.send_personal_message(
-                        json.dumps({
-                            "type": "thinking_update",
-                            "thinking": parsed_response["thinking"],
-                            "has_thinking": True
-                        }, ensure_ascii=False),
-                        websocket
-                    )
+            # （思考分離の結果は completed フレームに含まれる）
+            # 受信と送信をキューで切り離し、クライアントへの送信待ちでLLMの受信を止めない
+            queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+            producer = asyncio.create_task(_produce_frames(queue, streaming_agent.stream_response(messages)))
+            try:
+                while (frame := await queue.get()) is not None:
+                    # バイナリフレームで送信し、テキストフレームのUTF-8検証を省く
+                    await websocket.send_bytes(frame)
+            finally:
+                producer.cancel()
             
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
+        pass
     except Exception as e:
-        await manager.send_personal_message(json.dumps({
+        await websocket.send_bytes(orjson.dumps({
             "type": "error",
             "content": f"エラー: {str(e)}"
-        }, ensure_ascii=False), websocket)
+        }))
 
 # ヘルスチェック
 @app.get("/health")
@@ -438,5 +466,21 @@ async def export_kpi_metrics():
     return {"filename": filename, "message": "KPI測定結果をエクスポートしました"}
 
 # サーバー起動
+# 複数ワーカーで動かす場合は WORKERS=N python main.py で起動する
+# （WebSocketエンドポイントは接続ごとに完結しており共有状態を持たない。検索・応答キャッシュはワーカーごとに保持される）
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=True) 
\ No newline at end of file
+    dev_mode = bool(os.getenv("DEV"))
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        # reload はファイル監視プロセスが加わるため開発時（DEV=1）のみ有効化
+        reload=dev_mode,
+        workers=1 if dev_mode else int(os.getenv("WORKERS", "1")),
+        # uvloop / httptools がインストールされていれば auto で自動的に選択される
+        loop="auto",
+        http="auto",
+        log_level=os.getenv("LOG_LEVEL", "info" if dev_mode else "warning"),
+        # WebSocketフレームは permessage-deflate で圧縮する
+        ws_per_message_deflate=True
+    )
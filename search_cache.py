@@ -0,0 +1,95 @@
+"""
+Web検索結果の永続キャッシュ
+正規化したクエリをキーに検索結果をSQLiteへ保存し、DDGへの重複リクエストを削減する
+"""
+
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Any, Dict, List, Optional
+
+import orjson
+
+
+def normalize_query(query: str) -> str:
+    """
+    検索クエリを正規化
+    
+    全角/半角の統一（NFKC）、小文字化、連続する空白の圧縮を行う
+    """
+    return " ".join(unicodedata.normalize("NFKC", query).lower().split())
+
+
+class SearchCache:
+    """SQLiteベースの検索結果キャッシュ"""
+    
+    def __init__(self, db_path: str = "search_cache.db", ttl: float = 3600.0):
+        """
+        Args:
+            db_path: SQLiteデータベースファイルのパス
+            ttl: キャッシュの有効期間（秒）
+        """
+        self.db_path = db_path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+    
+    def _get_connection(self) -> sqlite3.Connection:
+        """データベース接続を取得（初回アクセス時にテーブルを作成）"""
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS ddg_cache ("
+                "key TEXT PRIMARY KEY, results_json TEXT NOT NULL, ts INTEGER NOT NULL)"
+            )
+            self._conn.commit()
+        return self._conn
+    
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        有効期限内のキャッシュを取得
+        
+        Args:
+            key: キャッシュキー
+            
+        Returns:
+            キャッシュされた検索結果（存在しない場合はNone）
+        """
+        try:
+            with self._lock:
+                row = self._get_connection().execute(
+                    "SELECT results_json FROM ddg_cache WHERE key = ? AND ts > ?",
+                    (key, int(time.time() - self.ttl))
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"検索キャッシュの読み込みエラー: {e}")
+            return None
+        
+        return orjson.loads(row[0]) if row else None
+    
+    def set(self, key: str, results: List[Dict[str, Any]]):
+        """
+        検索結果をキャッシュに保存
+        
+        Args:
+            key: キャッシュキー
+            results: 検索結果のリスト
+        """
+        try:
+            with self._lock:
+                conn = self._get_connection()
+                conn.execute(
+                    "INSERT OR REPLACE INTO ddg_cache (key, results_json, ts) VALUES (?, ?, ?)",
+                    (key, orjson.dumps(results).decode(), int(time.time()))
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"検索キャッシュの書き込みエラー: {e}")
+    
+    def close(self):
+        """データベース接続を閉じる"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,172 @@
+"""
+LLM応答のセマンティックキャッシュ
+質問文の埋め込みベクトルのコサイン類似度で類似質問を検出し、LLM呼び出しを省略する
+"""
+
+import asyncio
+import hashlib
+import math
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+# 埋め込み生成関数の型（テキスト → ベクトル）
+EmbedFunction = Callable[[str], Awaitable[List[float]]]
+
+
+@dataclass
+class CacheEntry:
+    """キャッシュエントリ"""
+    embedding: Optional[List[float]]
+    norm: float
+    response: Any
+    created_at: float
+
+
+class SemanticCache:
+    """
+    埋め込み類似度ベースのLLM応答キャッシュ
+    
+    ネームスペース（intent / plan など）ごとにエントリを保持し、
+    完全一致 → 類似度検索の順に参照する
+    """
+    
+    def __init__(self,
+                 embed_function: Optional[EmbedFunction] = None,
+                 similarity_threshold: float = 0.9,
+                 ttl: float = 3600.0,
+                 max_entries: int = 512):
+        """
+        Args:
+            embed_function: 埋め込み生成関数（Noneの場合は完全一致のみ）
+            similarity_threshold: キャッシュヒットとみなすコサイン類似度の下限
+            ttl: エントリの有効期間（秒）
+            max_entries: ネームスペースごとの最大エントリ数
+        """
+        self.embed_function = embed_function
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: Dict[str, "OrderedDict[str, CacheEntry]"] = {}
+        # 同じ質問の埋め込みは並列呼び出し間でも1回だけ計算する
+        self._embeddings: "OrderedDict[str, asyncio.Future]" = OrderedDict()
+    
+    @staticmethod
+    def _make_key(text: str) -> str:
+        """完全一致用のキーを生成"""
+        return hashlib.sha256(text.strip().lower().encode("utf-8")).hexdigest()
+    
+    async def _embed_safely(self, text: str) -> Optional[List[float]]:
+        """埋め込みを生成（失敗時はNone）"""
+        try:
+            return await self.embed_function(text)
+        except Exception as e:
+            print(f"セマンティックキャッシュの埋め込み取得に失敗: {e}")
+            return None
+    
+    async def _get_embedding(self, key: str, text: str) -> Optional[List[float]]:
+        """埋め込みを取得（計算中・計算済みのものは再利用）"""
+        if self.embed_function is None:
+            return None
+        
+        future = self._embeddings.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._embed_safely(text))
+            self._embeddings[key] = future
+            if len(self._embeddings) > self.max_entries:
+                self._embeddings.popitem(last=False)
+        else:
+            self._embeddings.move_to_end(key)
+        
+        return await future
+    
+    def _is_expired(self, entry: CacheEntry) -> bool:
+        """エントリの有効期限切れを判定"""
+        return time.time() - entry.created_at > self.ttl
+    
+    async def lookup(self, namespace: str, text: str, semantic: bool = True) -> Optional[Any]:
+        """
+        キャッシュを検索
+        
+        Args:
+            namespace: キャッシュのネームスペース
+            text: 検索キーとなるテキスト（ユーザーの質問）
+            semantic: 完全一致しない場合に類似度検索を行うかどうか
+                （Falseの場合は埋め込みを生成しない）
+            
+        Returns:
+            キャッシュされた応答（ヒットしない場合はNone）
+        """
+        entries = self._entries.get(namespace)
+        if not entries:
+            return None
+        
+        # 完全一致
+        key = self._make_key(text)
+        entry = entries.get(key)
+        if entry is not None:
+            if not self._is_expired(entry):
+                entries.move_to_end(key)
+                return entry.response
+            del entries[key]
+        
+        if not semantic:
+            return None
+        
+        # 類似度検索
+        embedding = await self._get_embedding(key, text)
+        if embedding is None:
+            return None
+        norm = math.sqrt(sum(x * x for x in embedding))
+        if norm == 0.0:
+            return None
+        
+        best_key = None
+        best_similarity = self.similarity_threshold
+        for entry_key, entry in list(entries.items()):
+            if self._is_expired(entry):
+                del entries[entry_key]
+                continue
+            if entry.embedding is None or entry.norm == 0.0:
+                continue
+            dot = sum(a * b for a, b in zip(embedding, entry.embedding))
+            similarity = dot / (norm * entry.norm)
+            if similarity >= best_similarity:
+                best_key, best_similarity = entry_key, similarity
+        
+        if best_key is None:
+            return None
+        entries.move_to_end(best_key)
+        return entries[best_key].response
+    
+    async def store(self, namespace: str, text: str, response: Any, semantic: bool = True):
+        """
+        応答をキャッシュに保存
+        
+        Args:
+            namespace: キャッシュのネームスペース
+            text: キーとなるテキスト（ユーザーの質問）
+            response: LLMの応答（検索結果を含む辞書なども可）
+            semantic: 類似度検索の対象にするかどうか（Falseの場合は完全一致でのみヒットし、埋め込みを生成しない）
+        """
+        key = self._make_key(text)
+        embedding = await self._get_embedding(key, text) if semantic else None
+        norm = math.sqrt(sum(x * x for x in embedding)) if embedding else 0.0
+        
+        entries = self._entries.setdefault(namespace, OrderedDict())
+        entries[key] = CacheEntry(
+            embedding=embedding,
+            norm=norm,
+            response=response,
+            created_at=time.time()
+        )
+        entries.move_to_end(key)
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+    
+    def clear(self):
+        """キャッシュを全て削除"""
+        self._entries.clear()
+        self._embeddings.clear()
@@ -5,8 +5,15 @@ WebSocketでリアルタイムトークンストリーミングを提供
 """
 
 import asyncio
-import json
-from typing import Dict, List, Any, AsyncGenerator
+import os
+import time
+from typing import Dict, List, Any, AsyncGenerator, Optional
+
+import httpx
+import orjson
+
+from http_client import get_shared_client
+from thinking_parser import ThinkingParser
 
 # 新しいモジュール構造からインポート
 try:
@@ -16,18 +23,38 @@ try:
 except ImportError:
     print("新しいモジュールが利用できません。フォールバック実装を使用します。")
     # フォールバック用の古い実装をインポート
-    import httpx
     from ddgs import DDGS
     from langgraph_agent import web_search_function
     NEW_MODULES_AVAILABLE = False
 
+# トークンをまとめて送信する単位（トークン数・経過秒数のどちらかに達したら送信）
+STREAM_CHUNK_TOKENS = int(os.getenv("STREAM_CHUNK_TOKENS", "32"))
+STREAM_CHUNK_INTERVAL = float(os.getenv("STREAM_CHUNK_INTERVAL", "0.02"))
+
+# リクエストボディはorjsonで直接バイト列にシリアライズして送信する
+# 小さなNDJSONの圧縮・展開は割に合わないため、応答は無圧縮で受け取る
+STREAM_HEADERS = {"Content-Type": "application/json", "Accept-Encoding": "identity"}
+
+# フォールバック時に付与するシステムプロンプト（リクエスト間で共有するため変更しないこと）
+SYSTEM_PROMPT_MESSAGE = {
+    "role": "system",
+    "content": "あなたは日本語で応答する親切なAIアシスタントです。質問に対して正確で有用な回答を提供してください。"
+}
+
 
 class StreamingAgent:
     """ストリーミング応答エージェント"""
     
-    def __init__(self, model_name: str = "qwen3:30b"):
+    def __init__(self, model_name: str = "qwen3:30b", client: Optional[httpx.AsyncClient] = None):
+        """
+        Args:
+            model_name: 使用するモデル名
+            client: 使用するHTTPクライアント（Noneの場合はプロセス共有のクライアントを使用）
+        """
         self.model_name = model_name
         self.base_url = "http://localhost:11434"
+        self._client = client
+        self.thinking_parser = ThinkingParser()
         
         # 新しいモジュール構造を使用
         if NEW_MODULES_AVAILABLE:
@@ -35,6 +62,17 @@ class StreamingAgent:
         else:
             self.llm_client = None
     
+    async def close(self):
+        """LLMクライアントの接続を閉じる（アプリケーション終了時に呼び出す）"""
+        if self.llm_client is not None:
+            await self.llm_client.aclose()
+    
+    async def _get_client(self) -> httpx.AsyncClient:
+        """HTTPクライアントを取得（未指定の場合はプロセス共有のクライアント）"""
+        if self._client is None or self._client.is_closed:
+            self._client = await get_shared_client()
+        return self._client
+    
     async def stream_ollama_response(self, messages: List[Dict[str, Any]]) -> AsyncGenerator[str, None]:
         """Ollamaからストリーミング応答を取得"""
         try:
@@ -55,43 +93,45 @@ class StreamingAgent:
         """フォールバック用のストリーミング応答"""
         try:
             # システムプロンプトを追加
-            system_prompt = {
-                "role": "system",
-                "content": "あなたは日本語で応答する親切なAIアシスタントです。質問に対して正確で有用な回答を提供してください。"
-            }
-            
-            ollama_messages = [system_prompt] + messages
+            ollama_messages = [SYSTEM_PROMPT_MESSAGE, *messages]
             
-            async with httpx.AsyncClient() as client:
-                async with client.stream(
-                    "POST",
-                    f"{self.base_url}/api/chat",
-                    json={
-                        "model": self.model_name,
-                        "messages": ollama_messages,
-                        "stream": True
-                    },
-                    timeout=60.0
-                ) as response:
-                    if response.status_code != 200:
-                        yield f"エラー: Ollama API エラー ({response.status_code})"
-                        return
-                    
-                    async for line in response.aiter_lines():
-                        if line.strip():
-                            try:
-                                data = json.loads(line)
-                                if "message" in data and "content" in data["message"]:
-                                    content = data["message"]["content"]
-                                    if content:
-                                        yield content
-                                
-                                # 応答が完了したかチェック
-                                if data.get("done", False):
-                                    break
-                                    
-                            except json.JSONDecodeError:
-                                continue
+            client = await self._get_client()
+            async with client.stream(
+                "POST",
+                f"{self.base_url}/api/chat",
+                content=orjson.dumps({
+                    "model": self.model_name,
+                    "messages": ollama_messages,
+                    "stream": True
+                }),
+                headers=STREAM_HEADERS,
+                timeout=60.0
+            ) as response:
+                if response.status_code != 200:
+                    yield f"エラー: Ollama API エラー ({response.status_code})"
+                    return
+                
+                # NDJSONをバイト列のまま行分割し、orjsonで解析する
+                buf = bytearray()
+                async for chunk in response.aiter_bytes(8192):
+                    buf.extend(chunk)
+                    while (newline := buf.find(b"\n")) != -1:
+                        line = bytes(buf[:newline])
+                        del buf[:newline + 1]
+                        if not line.strip():
+                            continue
+                        try:
+                            data = orjson.loads(line)
+                        except orjson.JSONDecodeError:
+                            continue
+                        
+                        message = data.get("message")
+                        if message and (content := message.get("content")):
+                            yield content
+                        
+                        # 応答が完了したかチェック
+                        if data.get("done", False):
+                            return
                                 
         except httpx.TimeoutException:
             yield "エラー: タイムアウトが発生しました"
@@ -147,7 +187,12 @@ URL: {result.get('url', 'N/A')}
             }
     
     async def stream_response(self, messages: List[Dict[str, Any]]) -> AsyncGenerator[Dict[str, Any], None]:
-        """完全なストリーミング応答処理"""
+        """
+        完全なストリーミング応答処理
+        
+        token フレームの辞書は毎回同じオブジェクトを書き換えて返すため、
+        受け取った側は次のフレームを取得する前にシリアライズすること
+        """
         try:
             # 検索と前処理
             yield {"type": "status", "content": "検索中..."}
@@ -167,20 +212,37 @@ URL: {result.get('url', 'N/A')}
             # 生成開始
             yield {"type": "status", "content": "回答を生成中..."}
             
-            # ストリーミング応答
-            full_response = ""
+            # ストリーミング応答（フレーム数を減らすため、トークンを一定量・一定時間ごとにまとめて送信）
+            response_parts = []
+            buffer = []
+            token_frame = {"type": "token", "content": ""}
+            last_flush = time.monotonic()
             async for token in self.stream_ollama_response(processed["messages"]):
                 if token.startswith("エラー:"):
                     yield {"type": "error", "content": token}
                     return
                 
-                full_response += token
-                yield {"type": "token", "content": token}
+                response_parts.append(token)
+                buffer.append(token)
+                now = time.monotonic()
+                if len(buffer) >= STREAM_CHUNK_TOKENS or now - last_flush >= STREAM_CHUNK_INTERVAL:
+                    token_frame["content"] = "".join(buffer)
+                    yield token_frame
+                    buffer.clear()
+                    last_flush = now
+            
+            if buffer:
+                token_frame["content"] = "".join(buffer)
+                yield token_frame
             
-            # 完了通知
+            # 完了通知（思考部分の分離もここで1回だけ行う）
+            full_response = "".join(response_parts)
+            parsed_response = self.thinking_parser.parse_response(full_response)
             yield {
                 "type": "completed",
                 "content": full_response,
+                "thinking": parsed_response["thinking"] if parsed_response["has_thinking"] else None,
+                "has_thinking": parsed_response["has_thinking"],
                 "search_results": processed["search_results"]
             }
             
@@ -0,0 +1,82 @@
+"""
+pytest 共通設定
+LLM・ネットワークに依存するテストは --run-integration 指定時のみ実行する
+"""
+
+import os
+import sys
+
+import httpx
+import orjson
+import pytest
+
+# プロジェクトルートをパスに追加
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import http_client
+
+# モックのOllamaが返す応答
+MOCK_OLLAMA_RESPONSE = "<think>\nテスト用の思考です。\n</think>\n\nテスト用の応答です。"
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--run-integration",
+        action="store_true",
+        default=False,
+        help="Ollama・Web検索に実際に接続する統合テストを実行する"
+    )
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "integration: Ollama・Web検索に実際に接続する統合テスト")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--run-integration"):
+        return
+    skip_integration = pytest.mark.skip(reason="統合テストは --run-integration 指定時のみ実行")
+    for item in items:
+        if "integration" in item.keywords:
+            item.add_marker(skip_integration)
+
+
+def _mock_ollama_handler(request: httpx.Request) -> httpx.Response:
+    """Ollama API の応答を模倣する（ネットワークには接続しない）"""
+    path = request.url.path
+    if path == "/api/chat":
+        payload = orjson.loads(request.content)
+        if payload.get("stream"):
+            lines = [
+                {"message": {"role": "assistant", "content": MOCK_OLLAMA_RESPONSE}, "done": False},
+                {"message": {"role": "assistant", "content": ""}, "done": True},
+            ]
+            return httpx.Response(200, content=b"\n".join(orjson.dumps(line) for line in lines) + b"\n")
+        return httpx.Response(200, content=orjson.dumps(
+            {"message": {"role": "assistant", "content": MOCK_OLLAMA_RESPONSE}, "done": True}
+        ))
+    if path == "/api/embeddings":
+        return httpx.Response(200, content=orjson.dumps({"embedding": [0.1, 0.2, 0.3]}))
+    if path == "/api/version":
+        return httpx.Response(200, content=orjson.dumps({"version": "mock"}))
+    if path == "/api/show":
+        return httpx.Response(200, content=orjson.dumps({"details": {}}))
+    return httpx.Response(404, content=b"not found")
+
+
+@pytest.fixture(scope="session", autouse=True)
+def mock_ollama(request):
+    """
+    --run-integration 未指定時は、共有HTTPクライアントをモックのOllamaに差し替える
+    
+    共有クライアントを使う全てのLLMクライアントが実際のネットワークに接続しなくなる
+    """
+    if request.config.getoption("--run-integration"):
+        yield None
+        return
+    
+    client = httpx.AsyncClient(transport=httpx.MockTransport(_mock_ollama_handler))
+    original_client = http_client._shared_client
+    http_client._shared_client = client
+    yield client
+    http_client._shared_client = original_client
@@ -5,8 +5,17 @@ Chain of Thought (CoT) 思考プロセスのテスト
 """
 
 import pytest
+import pytest_asyncio
 import asyncio
-import json
+import copy
+import math
+import numbers
+import re
+import time
+from datetime import datetime
+
+import orjson
+from types import MappingProxyType
 from typing import Dict, Any, List
 import sys
 import os
@@ -14,87 +23,267 @@ import os
 # プロジェクトルートをパスに追加
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
-# 新しいモジュール構造に対応したインポート
-try:
-    from agent_pipeline import AdvancedRAGPipeline
-    from thinking_callback import ThinkingCallbackManager, ThinkingIntegration
-    from thinking_parser import ThinkingParser
-    from shared_state import AgentState, create_initial_state
-    from tools import web_search_function
-    from llm import OllamaLLMClient
-    NEW_MODULES_AVAILABLE = True
-except ImportError as e:
-    print(f"新しいモジュールのインポートエラー: {e}")
-    # フォールバック用
-    from agent_pipeline import AdvancedRAGPipeline
-    from thinking_callback import ThinkingCallbackManager, ThinkingIntegration
-    from thinking_parser import ThinkingParser
-    NEW_MODULES_AVAILABLE = False
+# 軽量な思考パーサーのみモジュール読み込み時にインポートする
+# （パイプライン・LLMクライアント等の重いモジュールは、使用するフィクスチャ・テスト内でインポート）
+from thinking_parser import ThinkingParser
+
+
+# テスト用のメッセージデータ（テスト間で共有するため変更不可にする）
+SAMPLE_MESSAGES = (
+    MappingProxyType({"role": "user", "content": "Python の基本的な文法について教えてください"}),
+)
+
+# 検索不要のシンプルなメッセージ
+SAMPLE_SIMPLE_MESSAGES = (
+    MappingProxyType({"role": "user", "content": "こんにちは"}),
+)
+
+
+def canned_pipeline_result(messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    オフライン実行用のパイプライン結果
+    
+    AdvancedRAGPipeline.process_message と同じ構造の固定値を返す（LLM・Web検索には接続しない）
+    入力の検証は行わないため、エラー処理のテストには実際のパイプラインを使用すること
+    """
+    timestamp = datetime.now().isoformat()
+    return {
+        "success": True,
+        "response": "Pythonは初心者にも学びやすいプログラミング言語です。",
+        "search_results": [
+            {"title": "Python チュートリアル", "url": "https://docs.python.org/ja/3/tutorial/", "snippet": "Pythonの基本的な文法"}
+        ],
+        "thinking_log": [
+            {"step": step, "timestamp": timestamp, "duration": 0.0, "input": {}, "output": {}}
+            for step in ["intent_analysis", "search_plan", "search", "answer"]
+        ],
+        "intent_analysis": {
+            "question_type": "説明",
+            "required_info": ["Pythonの基本文法"],
+            "needs_search": True,
+            "complexity": "simple"
+        },
+        "search_plan": {"search_needed": True, "keywords": ["Python 基本 文法"]}
+    }
+
+
+def _message_key(messages: List[Dict[str, Any]]) -> tuple:
+    """メッセージ列をキャッシュキー用のタプルに変換（JSONへのシリアライズは不要）"""
+    return tuple((message["role"], message["content"]) for message in messages)
+
+
+async def run_once(pipeline, messages: List[Dict[str, Any]], cache: Dict[tuple, Any]) -> Dict[str, Any]:
+    """
+    同一入力に対するパイプラインの実行結果をキャッシュして返す
+    
+    テスト間で結果が書き換えられないよう、コピーを返す
+    """
+    key = _message_key(messages)
+    if key not in cache:
+        cache[key] = await pipeline.process_message(messages)
+    return copy.deepcopy(cache[key])
+
+
+def _check_json_structure(result: Dict[str, Any]):
+    """返されるJSON構造の検証"""
+    # 必須フィールドの確認
+    required_fields = [
+        "success", "response", "search_results", 
+        "thinking_log", "intent_analysis", "search_plan"
+    ]
+    
+    for field in required_fields:
+        assert field in result, f"必須フィールド '{field}' が見つかりません"
+    
+    # データ型の確認
+    assert isinstance(result["success"], bool)
+    assert isinstance(result["response"], str)
+    assert isinstance(result["search_results"], list)
+    assert isinstance(result["thinking_log"], list)
+    assert isinstance(result["intent_analysis"], dict)
+    assert isinstance(result["search_plan"], dict)
+    
+    # APIからそのまま返せるよう、JSONとして往復できることを確認
+    assert orjson.loads(orjson.dumps(result)) == result
+    
+    assert result["success"] == True
+
+
+def _check_thinking_log(result: Dict[str, Any]):
+    """思考ログの構造とタイミング情報の検証"""
+    thinking_log = result["thinking_log"]
+    assert len(thinking_log) > 0
+    
+    # 各思考ステップの構造をチェック
+    for step in thinking_log:
+        assert "step" in step
+        assert "timestamp" in step
+        assert "duration" in step
+        assert step["step"] in ["intent_analysis", "search_plan", "search", "answer"]
+    
+    # 継続時間が有限の非負数であることをまとめて確認
+    durations = [step["duration"] for step in thinking_log]
+    assert all(isinstance(duration, numbers.Real) for duration in durations), f"非数値の継続時間: {durations}"
+    assert all(map(math.isfinite, durations)), f"有限でない継続時間: {durations}"
+    assert min(durations) >= 0, f"負の継続時間: {durations}"
+
+
+def _check_all_steps_executed(result: Dict[str, Any]):
+    """全ての段階的ステップが実行されたかの検証"""
+    executed_steps = {step["step"] for step in result["thinking_log"]}
+    
+    # 期待される全てのステップが実行されているかチェック
+    expected_steps = {"intent_analysis", "search_plan", "search", "answer"}
+    missing_steps = expected_steps - executed_steps
+    assert not missing_steps, f"未実行ステップ: {missing_steps}"
+
+
+def _check_intent_analysis(result: Dict[str, Any]):
+    """意図分析の構造の検証"""
+    intent_analysis = result["intent_analysis"]
+    
+    # 意図分析の必須フィールドをチェック
+    required_fields = ["question_type", "required_info", "needs_search", "complexity"]
+    for field in required_fields:
+        assert field in intent_analysis
+
+
+def _check_search_plan(result: Dict[str, Any]):
+    """検索計画の構造の検証"""
+    search_plan = result["search_plan"]
+    
+    # 検索計画の必須フィールドをチェック
+    if search_plan.get("search_needed", True):
+        assert "keywords" in search_plan
+        assert isinstance(search_plan["keywords"], list)
+
+
+# パイプライン結果の構造チェック（1回の実行結果に対してまとめて適用する）
+STRUCTURE_CHECKS = [
+    ("json_structure", _check_json_structure),
+    ("thinking_log", _check_thinking_log),
+    ("all_steps_executed", _check_all_steps_executed),
+    ("intent_analysis", _check_intent_analysis),
+    ("search_plan", _check_search_plan),
+]
+
+
+def _check_default_callback(callback_manager):
+    """デフォルトコールバックの存在確認"""
+    assert callback_manager.get_default_callback() is not None
+
+
+def _check_create_and_get_callback(callback_manager):
+    """コールバックの作成と取得の確認"""
+    # 新しいコールバックの作成
+    test_callback = callback_manager.create_callback("test", stdout_enabled=False)
+    assert test_callback is not None
+    
+    # 作成されたコールバックの取得
+    retrieved_callback = callback_manager.get_callback("test")
+    assert retrieved_callback is test_callback
+
+
+# 思考コールバックマネージャーのチェック（LLMを使わない同期処理のみ）
+CALLBACK_MANAGER_CHECKS = [
+    ("default_callback", _check_default_callback),
+    ("create_and_get_callback", _check_create_and_get_callback),
+]
 
 
 class TestCoTProcessing:
     """Chain of Thought処理のテスト"""
     
-    @pytest.fixture
-    def pipeline(self):
-        """パイプラインのテスト用インスタンス"""
+    @pytest.fixture(scope="session")
+    def pipeline(self, request):
+        """パイプラインのテスト用インスタンス（--run-integration 未指定時は固定の結果を返す）"""
+        from agent_pipeline import AdvancedRAGPipeline
+        
+        pipeline = AdvancedRAGPipeline()
+        if not request.config.getoption("--run-integration"):
+            async def process_message(messages):
+                return canned_pipeline_result(messages)
+            pipeline.process_message = process_message
+        return pipeline
+    
+    @pytest.fixture(scope="session")
+    def unpatched_pipeline(self):
+        """処理を差し替えないパイプライン（LLM・Web検索に到達しない入力の検証用）"""
+        from agent_pipeline import AdvancedRAGPipeline
+        
         return AdvancedRAGPipeline()
     
-    @pytest.fixture
+    @pytest.fixture(scope="session")
     def callback_manager(self):
-        """コールバックマネージャーのテスト用インスタンス"""
-        return ThinkingCallbackManager()
+        """
+        コールバックマネージャーのテスト用インスタンス
+        
+        stdoutログは別スレッドで書き込まれ、pytestの出力キャプチャ終了後に表示されるため無効にする
+        """
+        from thinking_callback import ThinkingCallbackManager
+        
+        return ThinkingCallbackManager(stdout_enabled=False)
     
-    @pytest.fixture
+    @pytest.fixture(scope="session")
     def integration(self, pipeline, callback_manager):
         """統合オブジェクトのテスト用インスタンス"""
+        from thinking_callback import ThinkingIntegration
+        
         return ThinkingIntegration(pipeline, callback_manager)
     
-    @pytest.fixture
+    @pytest.fixture(scope="session")
     def thinking_parser(self):
         """思考パーサーのテスト用インスタンス"""
         return ThinkingParser()
     
-    @pytest.fixture
+    @pytest.fixture(scope="module")
+    def think_pattern(self):
+        """<think>タグのパターン（一度だけコンパイルしてテスト間で共有）"""
+        return re.compile(r'<think>(.*?)</think>', re.DOTALL)
+    
+    @pytest.fixture(scope="session")
+    def pipeline_result_cache(self):
+        """入力メッセージごとのパイプライン実行結果"""
+        return {}
+    
+    @pytest_asyncio.fixture(scope="session", loop_scope="session")
+    async def warmup(self, pipeline, integration, pipeline_result_cache):
+        """
+        独立したパイプライン・統合処理を並行実行し、結果を事前に用意
+        
+        パイプラインの結果は pipeline_result_cache に格納され、各テストの run_once はキャッシュから返す
+        """
+        _, _, integration_result = await asyncio.gather(
+            run_once(pipeline, SAMPLE_MESSAGES, pipeline_result_cache),
+            run_once(pipeline, SAMPLE_SIMPLE_MESSAGES, pipeline_result_cache),
+            integration.process_with_thinking(SAMPLE_MESSAGES)
+        )
+        return {"integration_result": integration_result}
+    
+    @pytest.fixture(scope="session")
     def sample_messages(self):
         """テスト用のメッセージデータ"""
-        return [
-            {"role": "user", "content": "Python の基本的な文法について教えてください"}
-        ]
+        return SAMPLE_MESSAGES
     
-    @pytest.fixture
+    @pytest.fixture(scope="session")
     def sample_simple_messages(self):
         """検索不要のシンプルなメッセージ"""
-        return [
-            {"role": "user", "content": "こんにちは"}
-        ]
+        return SAMPLE_SIMPLE_MESSAGES
     
-    @pytest.mark.asyncio
-    async def test_pipeline_returns_thinking_log(self, pipeline, sample_messages):
-        """パイプラインが思考ログを返すかをテスト"""
-        result = await pipeline.process_message(sample_messages)
-        
-        # 基本的な構造のチェック
-        assert isinstance(result, dict)
-        assert "success" in result
-        assert "thinking_log" in result
-        
-        # 思考ログの存在をチェック
-        thinking_log = result["thinking_log"]
-        assert isinstance(thinking_log, list)
-        assert len(thinking_log) > 0
-        
-        # 各思考ステップの構造をチェック
-        for step in thinking_log:
-            assert "step" in step
-            assert "timestamp" in step
-            assert "duration" in step
-            assert step["step"] in ["intent_analysis", "search_plan", "search", "answer"]
-    
-    @pytest.mark.asyncio
-    async def test_integration_returns_thinking_session(self, integration, sample_messages):
+    @pytest.mark.asyncio(loop_scope="session")
+    async def test_pipeline_structure(self, warmup, pipeline, pipeline_result_cache, sample_messages):
+        """パイプラインの実行結果の構造をテスト（思考ログ・意図分析・検索計画・JSON構造）"""
+        result = await run_once(pipeline, sample_messages, pipeline_result_cache)
+        
+        for name, check in STRUCTURE_CHECKS:
+            try:
+                check(result)
+            except AssertionError as e:
+                pytest.fail(f"{name}: {e}")
+    
+    def test_integration_returns_thinking_session(self, warmup):
         """統合オブジェクトが思考セッションを返すかをテスト"""
-        result = await integration.process_with_thinking(sample_messages)
+        result = copy.deepcopy(warmup["integration_result"])
         
         # 基本的な構造のチェック
         assert isinstance(result, dict)
@@ -111,98 +300,51 @@ class TestCoTProcessing:
         assert "steps" in thinking_session
         assert "status" in thinking_session
     
-    @pytest.mark.asyncio
-    async def test_intent_analysis_structure(self, pipeline, sample_messages):
-        """意図分析の構造をテスト"""
-        result = await pipeline.process_message(sample_messages)
-        
-        assert result["success"] == True
-        assert "intent_analysis" in result
-        
-        intent_analysis = result["intent_analysis"]
-        assert isinstance(intent_analysis, dict)
-        
-        # 意図分析の必須フィールドをチェック
-        required_fields = ["question_type", "required_info", "needs_search", "complexity"]
-        for field in required_fields:
-            assert field in intent_analysis
-    
-    @pytest.mark.asyncio
-    async def test_search_plan_structure(self, pipeline, sample_messages):
-        """検索計画の構造をテスト"""
-        result = await pipeline.process_message(sample_messages)
-        
-        assert result["success"] == True
-        assert "search_plan" in result
-        
-        search_plan = result["search_plan"]
-        assert isinstance(search_plan, dict)
-        
-        # 検索計画の必須フィールドをチェック
-        if search_plan.get("search_needed", True):
-            assert "keywords" in search_plan
-            assert isinstance(search_plan["keywords"], list)
-    
-    @pytest.mark.asyncio
-    async def test_thinking_parser_with_think_tags(self, thinking_parser):
-        """思考パーサーが<think>タグを正しく処理するかをテスト"""
-        # <think>タグ付きの応答をテスト
-        sample_response = """<think>
+    @pytest.mark.parametrize("sample_response, has_thinking, thinking_substr, answer_substr", [
+        # <think>タグ付きの応答
+        ("""<think>
 ユーザーがPythonについて質問しています。
 基本的な文法について説明する必要があります。
 </think>
 
-Pythonは初心者にも学びやすいプログラミング言語です。基本的な文法について説明します。"""
+Pythonは初心者にも学びやすいプログラミング言語です。基本的な文法について説明します。""",
+         True, "ユーザーがPythonについて質問しています", "Pythonは初心者にも学びやすい"),
+        # <think>タグなしの応答
+        ("Pythonは初心者にも学びやすいプログラミング言語です。",
+         False, "", "Pythonは初心者にも学びやすいプログラミング言語です。"),
+    ])
+    def test_thinking_parser(self, thinking_parser, think_pattern, sample_response, has_thinking, thinking_substr, answer_substr):
+        """思考パーサーが<think>タグの有無に応じて思考と回答を分離するかをテスト"""
+        # パーサーはコンパイル済みのパターンを保持している
+        assert isinstance(thinking_parser.think_pattern, re.Pattern)
+        assert thinking_parser.think_pattern.pattern == think_pattern.pattern
+        assert (think_pattern.search(sample_response) is not None) is has_thinking
         
         result = thinking_parser.parse_response(sample_response)
         
-        assert result["has_thinking"] == True
-        assert "ユーザーがPythonについて質問しています" in result["thinking"]
-        assert "Pythonは初心者にも学びやすい" in result["answer"]
+        assert result["has_thinking"] is has_thinking
+        if has_thinking:
+            assert thinking_substr in result["thinking"]
+        else:
+            assert result["thinking"] == ""
+        assert answer_substr in result["answer"]
     
-    @pytest.mark.asyncio
-    async def test_thinking_parser_without_think_tags(self, thinking_parser):
-        """思考パーサーが<think>タグなしの応答を正しく処理するかをテスト"""
-        sample_response = "Pythonは初心者にも学びやすいプログラミング言語です。"
-        
-        result = thinking_parser.parse_response(sample_response)
-        
-        assert result["has_thinking"] == False
-        assert result["thinking"] == ""
-        assert result["answer"] == sample_response
-    
-    @pytest.mark.asyncio
-    async def test_all_pipeline_steps_executed(self, pipeline, sample_messages):
-        """全ての段階的ステップが実行されるかをテスト"""
-        result = await pipeline.process_message(sample_messages)
-        
-        assert result["success"] == True
-        
-        # 実行されたステップの確認
-        thinking_log = result["thinking_log"]
-        executed_steps = [step["step"] for step in thinking_log]
-        
-        # 期待される全てのステップが実行されているかチェック
-        expected_steps = ["intent_analysis", "search_plan", "search", "answer"]
-        for step in expected_steps:
-            assert step in executed_steps
-    
-    @pytest.mark.asyncio
-    async def test_error_handling_in_pipeline(self, pipeline):
+    @pytest.mark.asyncio(loop_scope="session")
+    async def test_error_handling_in_pipeline(self, unpatched_pipeline):
         """パイプラインのエラーハンドリングをテスト"""
         # 無効なメッセージでテスト
         invalid_messages = []
         
-        result = await pipeline.process_message(invalid_messages)
+        result = await unpatched_pipeline.process_message(invalid_messages)
         
         assert result["success"] == False
         assert "error" in result
         assert "メッセージが空です" in result["error"]
     
-    @pytest.mark.asyncio
-    async def test_search_skipping_logic(self, pipeline, sample_simple_messages):
+    @pytest.mark.asyncio(loop_scope="session")
+    async def test_search_skipping_logic(self, warmup, pipeline, pipeline_result_cache, sample_simple_messages):
         """検索スキップロジックをテスト"""
-        result = await pipeline.process_message(sample_simple_messages)
+        result = await run_once(pipeline, sample_simple_messages, pipeline_result_cache)
         
         # 基本的な応答の確認
         assert result["success"] == True
@@ -217,11 +359,14 @@ Pythonは初心者にも学びやすいプログラミング言語です。基
             assert "search_results" in result
             assert isinstance(result["search_results"], list)
     
-    @pytest.mark.skipif(not NEW_MODULES_AVAILABLE, reason="新しいモジュールが利用できません")
     def test_new_module_structure(self):
         """新しいモジュール構造のテスト"""
+        # 新しいモジュールが利用できない場合はスキップ
+        shared_state = pytest.importorskip("shared_state")
+        llm = pytest.importorskip("llm")
+        
         # 統一AgentStateのテスト
-        state = create_initial_state("テスト質問", [])
+        state = shared_state.create_initial_state("テスト質問", [])
         assert isinstance(state, dict)
         assert "user_query" in state
         assert "thinking_log" in state
@@ -229,7 +374,7 @@ Pythonは初心者にも学びやすいプログラミング言語です。基
         assert "timestamp" in state
         
         # LLMクライアントのテスト
-        llm_client = OllamaLLMClient()
+        llm_client = llm.OllamaLLMClient()
         assert llm_client.model_name == "qwen3:30b"
         assert llm_client.base_url == "http://localhost:11434"
         
@@ -238,13 +383,107 @@ Pythonは初心者にも学びやすいプログラミング言語です。基
         assert isinstance(system_prompt, str)
         assert len(system_prompt) > 0
     
-    @pytest.mark.asyncio
-    @pytest.mark.skipif(not NEW_MODULES_AVAILABLE, reason="新しいモジュールが利用できません")
+    @pytest.mark.asyncio(loop_scope="session")
+    async def test_llm_client_with_mock_ollama(self, mock_ollama):
+        """LLMクライアントが共有HTTPクライアント経由で応答を取得できるかをテスト"""
+        if mock_ollama is None:
+            pytest.skip("実際のOllamaに接続する場合はモックを使用しない")
+        llm = pytest.importorskip("llm")
+        
+        llm_client = llm.OllamaLLMClient()
+        messages = [{"role": "user", "content": "こんにちは"}]
+        
+        response = await llm_client.generate_response(messages)
+        streamed = "".join([token async for token in llm_client.stream_response(messages)])
+        
+        assert response == streamed
+        assert "テスト用の応答です。" in response
+    
+    @pytest.mark.asyncio(loop_scope="session")
+    async def test_agent_fails_fast_when_ollama_is_down(self, monkeypatch):
+        """Ollamaが停止している場合、Web検索の完了を待たずにエラーを返すかをテスト"""
+        httpx = pytest.importorskip("httpx")
+        llm = pytest.importorskip("llm")
+        langgraph_agent = pytest.importorskip("langgraph_agent")
+        if not langgraph_agent.NEW_MODULES_AVAILABLE:
+            pytest.skip("新しいモジュール構造が利用できません")
+        
+        # 完了までに時間のかかるWeb検索
+        search_cancelled = asyncio.Event()
+        
+        async def slow_search(query, max_results=5):
+            try:
+                await asyncio.sleep(10)
+                return []
+            except asyncio.CancelledError:
+                search_cancelled.set()
+                raise
+        
+        monkeypatch.setattr(langgraph_agent, "web_search_function", slow_search)
+        
+        # 全てのリクエストに503を返すOllama
+        unavailable_client = httpx.AsyncClient(
+            transport=httpx.MockTransport(lambda request: httpx.Response(503))
+        )
+        agent = langgraph_agent.SimpleRAGAgent()
+        agent.llm = llm.SimpleLLMClient(client=unavailable_client)
+        agent._system_primed = True  # システムプロンプトのウォームアップは送信しない
+        
+        try:
+            start_time = time.perf_counter()
+            result = await agent.process_message(list(SAMPLE_MESSAGES), no_cache=True)
+            elapsed = time.perf_counter() - start_time
+        finally:
+            await unavailable_client.aclose()
+        
+        assert result["success"] is False
+        assert "Ollama" in result["error"]
+        assert elapsed < 5.0
+        await asyncio.wait_for(search_cancelled.wait(), timeout=1.0)
+    
+    @pytest.mark.asyncio(loop_scope="session")
+    async def test_fast_model_falls_back_when_missing(self):
+        """軽量モデルが未取得（404）の場合に既定のモデルで再試行するかをテスト"""
+        httpx = pytest.importorskip("httpx")
+        llm = pytest.importorskip("llm")
+        from agent_pipeline import AdvancedRAGPipeline
+        
+        requested_models = []
+        
+        def handler(request):
+            model = orjson.loads(request.content)["model"]
+            requested_models.append(model)
+            if model == "missing-model":
+                return httpx.Response(404, content=b'{"error":"model not found"}')
+            return httpx.Response(200, content=orjson.dumps(
+                {"message": {"role": "assistant", "content": "応答です"}, "done": True}
+            ) + b"\n")
+        
+        mock_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        pipeline = AdvancedRAGPipeline(fast_model_name="missing-model")
+        pipeline.llm_client = llm.OllamaLLMClient(model_name=pipeline.model_name, client=mock_client)
+        
+        try:
+            response = await pipeline._call_llm(
+                [{"role": "user", "content": "こんにちは"}], model=pipeline.fast_model_name
+            )
+        finally:
+            await mock_client.aclose()
+        
+        assert response == "応答です"
+        assert requested_models == ["missing-model", pipeline.model_name]
+        assert pipeline.fast_model_name == pipeline.model_name
+    
+    @pytest.mark.asyncio(loop_scope="session")
+    @pytest.mark.integration
     async def test_unified_web_search_function(self):
         """統一Web検索関数のテスト"""
+        # 新しいモジュールが利用できない場合はスキップ
+        tools = pytest.importorskip("tools")
+        
         # 簡単な検索テスト
         try:
-            results = await web_search_function("Python", max_results=2)
+            results = await tools.web_search_function("Python", max_results=2)
             assert isinstance(results, list)
             assert len(results) <= 2
             
@@ -257,73 +496,26 @@ Pythonは初心者にも学びやすいプログラミング言語です。基
             # 検索エラーの場合もテスト通過（ネットワーク依存のため）
             pass
     
-    @pytest.mark.asyncio
-    async def test_thinking_log_timing(self, pipeline, sample_messages):
-        """思考ログのタイミング情報をテスト"""
-        result = await pipeline.process_message(sample_messages)
-        
-        assert result["success"] == True
-        
-        thinking_log = result["thinking_log"]
-        
-        for step in thinking_log:
-            # タイミング情報の確認
-            assert "timestamp" in step
-            assert "duration" in step
-            
-            # 継続時間が正の値であることを確認
-            assert isinstance(step["duration"], (int, float))
-            assert step["duration"] >= 0
+    @pytest.mark.parametrize(
+        "check",
+        [check for _, check in CALLBACK_MANAGER_CHECKS],
+        ids=[name for name, _ in CALLBACK_MANAGER_CHECKS]
+    )
+    def test_thinking_callback_manager(self, callback_manager, check):
+        """思考コールバックマネージャーの作成・取得をテスト"""
+        check(callback_manager)
     
-    @pytest.mark.asyncio
-    async def test_json_structure_validation(self, pipeline, sample_messages):
-        """返されるJSON構造の検証"""
-        result = await pipeline.process_message(sample_messages)
-        
-        # 必須フィールドの確認
-        required_fields = [
-            "success", "response", "search_results", 
-            "thinking_log", "intent_analysis", "search_plan"
-        ]
-        
-        for field in required_fields:
-            assert field in result, f"必須フィールド '{field}' が見つかりません"
-        
-        # データ型の確認
-        assert isinstance(result["success"], bool)
-        assert isinstance(result["response"], str)
-        assert isinstance(result["search_results"], list)
-        assert isinstance(result["thinking_log"], list)
-        assert isinstance(result["intent_analysis"], dict)
-        assert isinstance(result["search_plan"], dict)
-    
-    def test_thinking_callback_manager_creation(self, callback_manager):
-        """思考コールバックマネージャーの作成をテスト"""
-        # デフォルトコールバックの存在確認
-        default_callback = callback_manager.get_default_callback()
-        assert default_callback is not None
-        
-        # 新しいコールバックの作成
-        test_callback = callback_manager.create_callback("test", stdout_enabled=False)
-        assert test_callback is not None
-        
-        # 作成されたコールバックの取得
-        retrieved_callback = callback_manager.get_callback("test")
-        assert retrieved_callback is test_callback
-    
-    @pytest.mark.asyncio
+    @pytest.mark.asyncio(loop_scope="session")
+    @pytest.mark.integration
     async def test_performance_requirements(self, pipeline, sample_messages):
         """パフォーマンス要件のテスト（6秒以内）"""
-        import time
-        
-        start_time = time.time()
+        # 時刻補正の影響を受けない単調増加カウンタで計測
+        start_ns = time.perf_counter_ns()
         result = await pipeline.process_message(sample_messages)
-        end_time = time.time()
-        
-        duration = end_time - start_time
+        elapsed_ns = time.perf_counter_ns() - start_ns
         
         # 6秒以内であることを確認（KPI要件）
-        assert duration <= 6.0, f"処理時間が6秒を超過しました: {duration:.2f}秒"
+        assert elapsed_ns <= 6_000_000_000, f"処理時間が6秒を超過しました: {elapsed_ns / 1e9:.2f}秒"
         assert result["success"] == True
 
 
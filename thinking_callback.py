@@ -3,13 +3,126 @@
 中間思考JSONをstdoutとAPIに渡すためのコールバック処理
 """
 
-import json
 import sys
-from typing import Dict, Any, List, Optional, Callable
+import time
+import atexit
+import queue
+import threading
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, Callable, BinaryIO
 from datetime import datetime
 import asyncio
 from pathlib import Path
 
+import orjson
+
+
+def _dumps(obj: Any, pretty: bool = False) -> bytes:
+    """
+    ログ用にJSONをバイト列へシリアライズ（orjsonはUTF-8をそのまま出力する）
+    
+    既定は機械処理向けのコンパクト形式。pretty=True の場合のみインデントする
+    """
+    option = orjson.OPT_NON_STR_KEYS
+    if pretty:
+        option |= orjson.OPT_INDENT_2
+    return orjson.dumps(obj, option=option)
+
+
+def _write_stdout(line: bytes):
+    """stdoutにバイト列を書き込む（バイナリバッファが無いストリームでは文字列として書き込む）"""
+    buffer = getattr(sys.stdout, "buffer", None)
+    if buffer is None:
+        sys.stdout.write(line.decode("utf-8"))
+        sys.stdout.flush()
+        return
+    # テキスト層に残っている出力を先に吐き出し、出力順序を保つ
+    sys.stdout.flush()
+    buffer.write(line)
+    buffer.flush()
+
+
+# stdoutログの書き込みキュー（書き込みはバックグラウンドスレッドでまとめて行う）
+LOG_QUEUE_SIZE = 10000
+LOG_BATCH_SIZE = 256
+
+_log_queue: "queue.Queue[bytes]" = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+_log_writer: Optional[threading.Thread] = None
+_log_writer_lock = threading.Lock()
+
+
+def _take_log_batch(first: bytes) -> bytes:
+    """キューに溜まっているログ行を最大 LOG_BATCH_SIZE 件まとめて取り出す"""
+    batch = [first]
+    while len(batch) < LOG_BATCH_SIZE:
+        try:
+            batch.append(_log_queue.get_nowait())
+        except queue.Empty:
+            break
+    return b"".join(batch)
+
+
+def _drain_log_queue():
+    """ログ書き込みスレッド本体：溜まったログ行を1回の書き込みで出力する"""
+    while True:
+        data = _take_log_batch(_log_queue.get())
+        try:
+            _write_stdout(data)
+        except Exception as e:
+            print(f"[THINKING_LOG_ERROR] {str(e)}", file=sys.stderr, flush=True)
+
+
+def _flush_log_queue():
+    """プロセス終了時にキューに残っているログを書き出す"""
+    while True:
+        try:
+            data = _take_log_batch(_log_queue.get_nowait())
+        except queue.Empty:
+            return
+        try:
+            _write_stdout(data)
+        except Exception:
+            return
+
+
+def _enqueue_log(line: bytes):
+    """ログ行を書き込みキューに追加（初回呼び出し時に書き込みスレッドを起動）"""
+    global _log_writer
+    if _log_writer is None:
+        with _log_writer_lock:
+            if _log_writer is None:
+                _log_writer = threading.Thread(
+                    target=_drain_log_queue, name="thinking-log-writer", daemon=True
+                )
+                _log_writer.start()
+                atexit.register(_flush_log_queue)
+    try:
+        _log_queue.put_nowait(line)
+    except queue.Full:
+        # キューが満杯の場合はログを破棄（呼び出し元をブロックしない）
+        pass
+
+
+@dataclass(slots=True)
+class StepEntry:
+    """
+    思考ステップの記録（セッションの steps に追加される）
+    
+    orjson・FastAPI ともに dataclass を直接シリアライズできるため、出力時まで辞書へ変換しない
+    """
+    step: str
+    timestamp: str
+    data: Dict[str, Any]
+
+
+@dataclass(slots=True)
+class ThinkingStepMessage:
+    """WebSocketに送信する思考ステップ（orjsonが中間の辞書を作らず直接シリアライズする）"""
+    step: str
+    data: Dict[str, Any]
+    timestamp: str
+    type: str = "thinking_step"
+
 
 class ThinkingCallback:
     """思考プロセスのコールバック管理クラス"""
@@ -17,24 +130,36 @@ class ThinkingCallback:
     def __init__(self, 
                  stdout_enabled: bool = True,
                  file_logging: bool = False,
-                 log_file: str = "thinking_logs.json"):
+                 log_file: str = "thinking_logs.jsonl",
+                 pretty: bool = False):
         self.stdout_enabled = stdout_enabled
+        # stdoutログをインデント付きで出力するか（デバッグ用）
+        self.pretty = pretty
         self.file_logging = file_logging
         self.log_file = log_file
         self.callbacks: List[Callable] = []
+        # ステップごとに走査するコールバックのスナップショット（登録・削除時のみ作り直す）
+        self._callbacks_snapshot: tuple = ()
         self.current_session = None
+        # セッション開始時刻（経過時間の計算用。壁時計の補正の影響を受けない monotonic を使用）
+        self._start_mono = 0.0
+        # セッション中に開いているログファイル（file_logging 有効時のみ）
+        self._log_fh: Optional[BinaryIO] = None
         
     def add_callback(self, callback: Callable):
         """コールバック関数を追加"""
         self.callbacks.append(callback)
+        self._callbacks_snapshot = tuple(self.callbacks)
     
     def remove_callback(self, callback: Callable):
         """コールバック関数を削除"""
         if callback in self.callbacks:
             self.callbacks.remove(callback)
+            self._callbacks_snapshot = tuple(self.callbacks)
     
     def start_session(self, session_id: str, user_query: str):
         """思考セッションを開始"""
+        self._start_mono = time.monotonic()
         self.current_session = {
             "session_id": session_id,
             "user_query": user_query,
@@ -47,33 +172,56 @@ class ThinkingCallback:
             "session_id": session_id,
             "user_query": user_query,
             "timestamp": self.current_session["start_time"]
-        })
+        }, timestamp=self.current_session["start_time"])
+        
+        if self.file_logging:
+            self._open_log_file()
+            self._log_to_file({
+                "event": "session_start",
+                "session_id": session_id,
+                "user_query": user_query,
+                "timestamp": self.current_session["start_time"]
+            })
     
     def log_step(self, step_name: str, step_data: Dict[str, Any]):
         """思考ステップをログに記録"""
         if not self.current_session:
             return
         
-        step_entry = {
-            "step": step_name,
-            "timestamp": datetime.now().isoformat(),
-            "data": step_data
-        }
+        # タイムスタンプはステップごとに1回だけ生成し、ログ・コールバックで共有する
+        timestamp = datetime.now().isoformat()
+        self.current_session["steps"].append(StepEntry(step_name, timestamp, step_data))
+        
+        # 出力先が無い場合はイベント名の組み立て・コールバック走査を省略
+        # （ステップ自体はセッション結果として返すため常に記録する）
+        if not self._should_log():
+            return
         
-        self.current_session["steps"].append(step_entry)
+        # ファイルにはステップごとに追記してフラッシュする（プロセスが途中で終了してもそこまでのログが残る）
+        if self._log_fh is not None:
+            self._log_to_file({
+                "event": "step",
+                "session_id": self.current_session["session_id"],
+                "step": step_name,
+                "timestamp": timestamp,
+                "data": step_data
+            })
         
         # stdoutに出力
-        self._log_to_stdout(f"STEP_{step_name.upper()}", step_data)
+        self._log_to_stdout(f"STEP_{step_name.upper()}", step_data, timestamp=timestamp)
         
-        # 登録されたコールバックを呼び出し
-        for callback in self.callbacks:
+        # 登録されたコールバックを呼び出し（途中で登録・削除されても走査中の内容は変わらない）
+        for callback in self._callbacks_snapshot:
             try:
-                callback(step_name, step_data)
+                if getattr(callback, "accepts_timestamp", False):
+                    callback(step_name, step_data, timestamp)
+                else:
+                    callback(step_name, step_data)
             except Exception as e:
                 self._log_to_stdout("CALLBACK_ERROR", {
                     "error": str(e),
                     "step": step_name
-                })
+                }, timestamp=timestamp)
     
     def end_session(self, final_response: str, success: bool = True):
         """思考セッションを終了"""
@@ -84,88 +232,111 @@ class ThinkingCallback:
         self.current_session["final_response"] = final_response
         self.current_session["status"] = "completed" if success else "failed"
         
+        duration = self._calculate_duration()
+        
         # 最終ログを出力
         self._log_to_stdout("SESSION_END", {
             "session_id": self.current_session["session_id"],
-            "duration": self._calculate_duration(),
+            "duration": duration,
             "steps_count": len(self.current_session["steps"]),
             "success": success
-        })
+        }, timestamp=self.current_session["end_time"])
         
-        # ファイルログ出力
-        if self.file_logging:
-            self._log_to_file()
+        # ファイルログ出力（終了レコードを書き込んでファイルを閉じる）
+        if self._log_fh is not None:
+            self._log_to_file({
+                "event": "session_end",
+                "session_id": self.current_session["session_id"],
+                "timestamp": self.current_session["end_time"],
+                "status": self.current_session["status"],
+                "final_response": final_response,
+                "duration": duration,
+                "steps_count": len(self.current_session["steps"])
+            })
+            self._close_log_file()
         
-        # セッションをリセット
-        session_data = self.current_session.copy()
+        # セッションをリセット（終了したセッションは保持しないため、複製せずそのまま返す）
+        session_data = self.current_session
         self.current_session = None
         
         return session_data
     
+    def _should_log(self) -> bool:
+        """ステップごとの出力先（stdout・ファイル・コールバック）が存在するか"""
+        return self.stdout_enabled or self._log_fh is not None or bool(self._callbacks_snapshot)
+    
     def get_current_session(self) -> Optional[Dict[str, Any]]:
         """現在のセッション情報を取得"""
         return self.current_session
     
-    def _log_to_stdout(self, event_type: str, data: Dict[str, Any]):
-        """stdoutに構造化ログを出力"""
+    def _log_to_stdout(self, event_type: str, data: Dict[str, Any], timestamp: Optional[str] = None):
+        """stdoutに構造化ログを出力（timestamp 未指定時は現在時刻を使用）"""
         if not self.stdout_enabled:
             return
         
         log_entry = {
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": timestamp or datetime.now().isoformat(),
             "event_type": event_type,
             "data": data
         }
         
         try:
-            print(f"[THINKING_LOG] {json.dumps(log_entry, ensure_ascii=False, indent=2)}", 
-                  file=sys.stdout, flush=True)
+            # シリアライズは呼び出し時点の内容を確定させるためここで行い、書き込みのみ別スレッドに任せる
+            _enqueue_log(b"[THINKING_LOG] " + _dumps(log_entry, self.pretty) + b"\n")
         except Exception as e:
             print(f"[THINKING_LOG_ERROR] {str(e)}", file=sys.stderr, flush=True)
     
-    def _log_to_file(self):
-        """ファイルにログを出力"""
-        if not self.current_session:
+    def _open_log_file(self):
+        """セッション用にログファイルを追記モードで開く（前のセッションが閉じられていなければ閉じる）"""
+        self._close_log_file()
+        try:
+            self._log_fh = open(Path(self.log_file), 'ab', buffering=65536)
+        except Exception as e:
+            self._log_fh = None
+            self._log_to_stdout("FILE_LOG_ERROR", {"error": str(e)})
+    
+    def _close_log_file(self):
+        """ログファイルを閉じる（バッファの内容はここで書き出される）"""
+        if self._log_fh is None:
             return
+        try:
+            self._log_fh.close()
+        except Exception as e:
+            self._log_to_stdout("FILE_LOG_ERROR", {"error": str(e)})
+        finally:
+            self._log_fh = None
+    
+    def _log_to_file(self, record: Dict[str, Any]):
+        """
+        ファイルにログを出力（JSONL形式で1レコード1行を追記）
         
+        レコードごとにOSへ書き出す（1レコード1回の書き込み）。電源断に備えた fsync は行わない
+        """
         try:
-            log_path = Path(self.log_file)
-            
-            # 既存のログを読み込み
-            logs = []
-            if log_path.exists():
-                with open(log_path, 'r', encoding='utf-8') as f:
-                    logs = json.load(f)
-            
-            # 新しいログを追加
-            logs.append(self.current_session)
-            
-            # ファイルに保存
-            with open(log_path, 'w', encoding='utf-8') as f:
-                json.dump(logs, f, ensure_ascii=False, indent=2)
-                
+            self._log_fh.write(_dumps(record) + b"\n")
+            self._log_fh.flush()
         except Exception as e:
             self._log_to_stdout("FILE_LOG_ERROR", {"error": str(e)})
+            self._close_log_file()
     
     def _calculate_duration(self) -> float:
-        """セッションの実行時間を計算"""
+        """セッションの実行時間を計算（ISO文字列を解析せず monotonic 時刻の差から求める）"""
         if not self.current_session:
             return 0.0
         
-        try:
-            start_time = datetime.fromisoformat(self.current_session["start_time"])
-            end_time = datetime.fromisoformat(self.current_session["end_time"])
-            return (end_time - start_time).total_seconds()
-        except:
-            return 0.0
+        return time.monotonic() - self._start_mono
 
 
 class ThinkingCallbackManager:
     """思考コールバックの管理クラス"""
     
-    def __init__(self):
+    def __init__(self, **default_callback_options):
+        """
+        Args:
+            default_callback_options: デフォルトコールバックの設定（例: stdout_enabled=False）
+        """
         self.callbacks: Dict[str, ThinkingCallback] = {}
-        self.default_callback = ThinkingCallback()
+        self.default_callback = ThinkingCallback(**default_callback_options)
     
     def create_callback(self, name: str, **kwargs) -> ThinkingCallback:
         """新しいコールバックを作成"""
@@ -188,40 +359,56 @@ class ThinkingCallbackManager:
 
 
 def create_api_callback(response_queue: asyncio.Queue) -> Callable:
-    """API応答用のコールバック関数を作成"""
-    def callback(step_name: str, step_data: Dict[str, Any]):
+    """
+    API応答用のコールバック関数を作成
+    
+    タイムスタンプは ThinkingCallback.log_step から受け取る（単体で呼ばれた場合のみ生成）
+    """
+    # ステップごとの属性参照を避けるため、使用する関数を事前に束縛しておく
+    now = datetime.now
+    put_nowait = response_queue.put_nowait
+    
+    def callback(step_name: str, step_data: Dict[str, Any], timestamp: Optional[str] = None):
         try:
             # 非同期キューに思考データを追加
-            response_queue.put_nowait({
+            put_nowait({
                 "type": "thinking_step",
                 "step": step_name,
                 "data": step_data,
-                "timestamp": datetime.now().isoformat()
+                "timestamp": timestamp or now().isoformat()
             })
         except asyncio.QueueFull:
             # キューが満杯の場合はスキップ
             pass
     
+    callback.accepts_timestamp = True
     return callback
 
 
 def create_websocket_callback(websocket) -> Callable:
-    """WebSocket用のコールバック関数を作成"""
-    def callback(step_name: str, step_data: Dict[str, Any]):
+    """
+    WebSocket用のコールバック関数を作成
+    
+    タイムスタンプは ThinkingCallback.log_step から受け取る（単体で呼ばれた場合のみ生成）
+    """
+    # ステップごとの属性参照を避けるため、使用する関数を事前に束縛しておく
+    now = datetime.now
+    create_task = asyncio.create_task
+    dumps = orjson.dumps
+    send_bytes = websocket.send_bytes
+    
+    def callback(step_name: str, step_data: Dict[str, Any], timestamp: Optional[str] = None):
+        message = ThinkingStepMessage(step_name, step_data, timestamp or now().isoformat())
+        
         try:
-            message = {
-                "type": "thinking_step",
-                "step": step_name,
-                "data": step_data,
-                "timestamp": datetime.now().isoformat()
-            }
-            
             # WebSocketでメッセージを送信（非同期）
-            asyncio.create_task(websocket.send_text(json.dumps(message, ensure_ascii=False)))
+            # orjsonの出力をそのままバイナリフレームで送り、文字列へのデコードを省く
+            create_task(send_bytes(dumps(message)))
         except Exception as e:
             # エラーは無視（WebSocket接続が切れている可能性）
             pass
     
+    callback.accepts_timestamp = True
     return callback
 
 
@@ -3,25 +3,27 @@
 <think>タグを含む応答を解析し、思考部分と実際の回答を分離
 """
 
+import functools
 import re
-from typing import Dict, Any, Optional
+from types import MappingProxyType
+from typing import Dict, Any, Mapping, Optional
+
+
+OPEN_TAG = '<think>'
+CLOSE_TAG = '</think>'
+# 開始・終了タグに共通する部分（どちらのタグも含まないことを1回の検索で判定する）
+TAG_SUFFIX = 'think>'
 
 
 class ThinkingParser:
     """思考部分を分離するパーサー"""
     
-    def __init__(self):
-        # <think>で始まる思考部分の正規表現パターン
-        self.think_pattern = re.compile(r'<think>(.*?)</think>', re.DOTALL)
-        # 終了タグが見つからない場合（途中で切れている場合）
-        self.think_unclosed_pattern = re.compile(r'<think>(.*?)(?=\n\n|\Z)', re.DOTALL)
-        # 実際の応答パターン（開始や終了の改行を含む）
-        self.think_flexible_pattern = re.compile(r'<think>(.*?)(?:</think>|$)', re.DOTALL)
-        # 不完全なタグパターン（</think>のみで開始される場合）
-        self.think_malformed_pattern = re.compile(r'^(.*?)</think>', re.DOTALL)
-        # 思考らしい内容の検出
-        self.think_content_pattern = re.compile(r'^.*?</think>\s*\n\s*(.*)$', re.DOTALL)
-        
+    # 正規表現はクラス定義時に1回だけコンパイルする
+    # <think>で始まる思考部分の正規表現パターン（タグ検出用。解析自体は str.find で行う）
+    think_pattern = re.compile(r'<think>(.*?)</think>', re.DOTALL)
+    # 終了タグと直後の空白（</think>で始まる応答からタグを除去する用）
+    think_close_pattern = re.compile(r'</think>\s*')
+    
     def parse_response(self, response: str) -> Dict[str, Any]:
         """
         応答を分析して思考部分と実際の回答を分離
@@ -43,57 +45,75 @@ class ThinkingParser:
             "original": response
         }
         
+        # 高速パス: <think> も </think> も含まない応答（最も多いケース）は1回の検索で返す
+        if TAG_SUFFIX not in response:
+            return result
+        
         # 特殊ケース: </think>で始まる不完全なタグの処理
         if response.startswith('</think>'):
             # </think>タグを全て削除し、残りを回答として扱う
-            import re
-            cleaned_response = re.sub(r'</think>\s*', '', response).strip()
+            cleaned_response = self.think_close_pattern.sub('', response).strip()
             result["answer"] = cleaned_response if cleaned_response else "応答が生成されました。"
             return result
         
-        # まず正規の<think>...</think>パターンで検索
-        match = self.think_pattern.search(response)
-        thinking_text = ""
-        answer_text = response
+        # 正規表現を使わず、タグ位置を1回ずつ検索して分割する
+        open_index = response.find(OPEN_TAG)
         
-        if not match:
-            # 次に柔軟なパターンで検索（終了タグがない場合も含む）
-            match = self.think_flexible_pattern.search(response)
+        if open_index == -1:
+            # 不完全なタグ（<think>が無く</think>のみ含まれる場合）
+            close_index = response.find(CLOSE_TAG)
+            if close_index == -1:
+                return result
+            
+            # </think>より前の部分を思考として扱う
+            thinking_text = response[:close_index].strip()
+            if thinking_text:  # 思考内容が実際にある場合のみ
+                # </think>以降を回答として扱う
+                answer_text = self._find_answer_after_close(response, close_index)
+                if answer_text is not None:
+                    result["has_thinking"] = True
+                    result["thinking"] = thinking_text
+                    result["answer"] = answer_text if answer_text else "応答が生成されました。"
+            return result
         
-        if not match:
-            # 最後に改行で区切られた未終了パターンで検索
-            match = self.think_unclosed_pattern.search(response)
+        thinking_start = open_index + len(OPEN_TAG)
+        close_index = response.find(CLOSE_TAG, thinking_start)
         
-        if not match:
-            # 不完全なタグパターンで検索（</think>で始まる場合）
-            malformed_match = self.think_malformed_pattern.search(response)
-            if malformed_match:
-                # </think>より前の部分を思考として扱う
-                thinking_text = malformed_match.group(1).strip()
-                if thinking_text:  # 思考内容が実際にある場合のみ
-                    # </think>以降を回答として扱う
-                    content_match = self.think_content_pattern.search(response)
-                    if content_match:
-                        answer_text = content_match.group(1).strip()
-                        result["has_thinking"] = True
-                        result["thinking"] = thinking_text
-                        result["answer"] = answer_text if answer_text else "応答が生成されました。"
-                        return result
+        if close_index == -1:
+            # 終了タグが無い場合（途中で切れている場合）は以降を全て思考として扱う
+            thinking_text = response[thinking_start:]
+            answer_text = response[:open_index]
+        else:
+            thinking_text = response[thinking_start:close_index]
+            answer_text = response[:open_index] + response[close_index + len(CLOSE_TAG):]
         
-        if match:
-            result["has_thinking"] = True
-            result["thinking"] = match.group(1).strip()
-            
-            # 思考部分を除去して実際の回答を取得
-            answer_text = response[:match.start()] + response[match.end():]
-            result["answer"] = answer_text.strip()
-            
-            # 空の回答の場合は最低限のメッセージを設定
-            if not result["answer"]:
-                result["answer"] = "応答が生成されました。"
+        result["has_thinking"] = True
+        result["thinking"] = thinking_text.strip()
+        
+        # 思考部分を除去して実際の回答を取得
+        result["answer"] = answer_text.strip()
+        
+        # 空の回答の場合は最低限のメッセージを設定
+        if not result["answer"]:
+            result["answer"] = "応答が生成されました。"
         
         return result
     
+    @staticmethod
+    def _find_answer_after_close(response: str, close_index: int) -> Optional[str]:
+        """
+        改行を含む空白が直後に続く最初の</think>を探し、それ以降を回答として返す
+        
+        該当する</think>が無い場合はNoneを返す
+        """
+        while close_index != -1:
+            rest = response[close_index + len(CLOSE_TAG):]
+            answer_text = rest.lstrip()
+            if '\n' in rest[:len(rest) - len(answer_text)]:
+                return answer_text.strip()
+            close_index = response.find(CLOSE_TAG, close_index + len(CLOSE_TAG))
+        return None
+    
     def format_for_frontend(self, parsed_response: Dict[str, Any]) -> Dict[str, Any]:
         """
         フロントエンド用にフォーマットされた応答を作成
@@ -112,12 +132,28 @@ class ThinkingParser:
         }
 
 
-def parse_thinking_response(response: str) -> Dict[str, Any]:
+# 便利関数で共有するパーサー
+_default_parser = ThinkingParser()
+
+# 解析結果をキャッシュする応答の最大文字数（巨大な文字列をキャッシュに保持しない）
+PARSE_CACHE_MAX_CHARS = 16 * 1024
+
+
+@functools.lru_cache(maxsize=512)
+def _parse_thinking_response_cached(response: str) -> Mapping[str, Any]:
+    # キャッシュした結果を呼び出し元が書き換えられないよう、読み取り専用で返す
+    return MappingProxyType(_default_parser.parse_response(response))
+
+
+def parse_thinking_response(response: str) -> Mapping[str, Any]:
     """
-    便利な関数：思考応答を分析
+    便利な関数：思考応答を分析（同一の応答はキャッシュから返す）
+    
+    戻り値は読み取り専用。変更する場合は dict() で複製すること
     """
-    parser = ThinkingParser()
-    return parser.parse_response(response)
+    if len(response) > PARSE_CACHE_MAX_CHARS:
+        return MappingProxyType(_default_parser.parse_response(response))
+    return _parse_thinking_response_cached(response)
 
 
 # 使用例とテスト
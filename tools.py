@@ -4,10 +4,63 @@ LangChain @tool デコレータを使用して、全システムで共通のWeb
 """
 
 import asyncio
-from typing import Dict, List, Any
+import threading
+import time
+from collections import OrderedDict
+from operator import itemgetter
+from typing import Dict, Iterable, List, Any, Tuple
 from langchain.tools import tool
 from ddgs import DDGS
 
+from kpi_monitor import kpi_monitor
+from llm import get_default_llm_client
+from search_cache import SearchCache, normalize_query
+from semantic_cache import SemanticCache
+
+
+async def _embed_query(text: str) -> List[float]:
+    """検索クエリの埋め込みを生成"""
+    return await get_default_llm_client().generate_embedding(text)
+
+
+# 検索結果の永続キャッシュ（正規化クエリの完全一致）
+search_cache = SearchCache()
+
+# 類似クエリ向けのセカンドチャンスキャッシュ（プロセス内）
+semantic_search_cache = SemanticCache(embed_function=_embed_query, ttl=search_cache.ttl)
+
+# プロセス内の検索結果キャッシュ（SQLiteへのアクセスも省略する）
+SEARCH_MEMORY_CACHE_SIZE = 512
+SEARCH_MEMORY_CACHE_TTL = 300.0
+_memory_cache: "OrderedDict[str, Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+
+# 検索リトライの初回待機秒数（以降は倍々に延ばす）
+SEARCH_RETRY_BASE_DELAY = 0.25
+
+# 実行中の検索（同一クエリの同時リクエストは1回の検索にまとめる）
+_inflight_searches: Dict[str, "asyncio.Task[List[Dict[str, Any]]]"] = {}
+
+
+def _memory_cache_get(key: str):
+    """有効期限内のプロセス内キャッシュを取得（存在しない場合はNone）"""
+    entry = _memory_cache.get(key)
+    if entry is None:
+        return None
+    stored_at, results = entry
+    if time.monotonic() - stored_at >= SEARCH_MEMORY_CACHE_TTL:
+        _memory_cache.pop(key, None)
+        return None
+    _memory_cache.move_to_end(key)
+    return results
+
+
+def _memory_cache_set(key: str, results: List[Dict[str, Any]]):
+    """プロセス内キャッシュに保存（上限を超えた場合は最も古いものから削除）"""
+    _memory_cache[key] = (time.monotonic(), results)
+    _memory_cache.move_to_end(key)
+    while len(_memory_cache) > SEARCH_MEMORY_CACHE_SIZE:
+        _memory_cache.popitem(last=False)
+
 
 @tool
 async def web_search_tool(query: str, max_results: int = 5) -> List[Dict[str, Any]]:
@@ -24,6 +77,90 @@ async def web_search_tool(query: str, max_results: int = 5) -> List[Dict[str, An
     return await web_search_with_retry(query, max_results, max_retries=3)
 
 
+# 再利用するDDGSインスタンスのプール（HTTPクライアントとCookieを検索間で再利用する）
+# インスタンスはスレッド安全ではないため、1回の検索の間だけ1つのスレッドが専有する
+DDGS_POOL_SIZE = 8
+_ddgs_pool: List[DDGS] = []
+_ddgs_pool_lock = threading.Lock()
+
+
+def _acquire_ddgs() -> DDGS:
+    """プールからDDGSインスタンスを取り出す（空の場合は新規作成）"""
+    with _ddgs_pool_lock:
+        ddgs = _ddgs_pool.pop() if _ddgs_pool else None
+    if ddgs is None:
+        return DDGS()
+    # DDGSは同一インスタンスで20秒以内に再度リクエストすると0.75秒待機するため、
+    # 新規インスタンスと同様に呼び出しごとの待機状態を初期化する
+    ddgs.sleep_timestamp = 0.0
+    return ddgs
+
+
+def _release_ddgs(ddgs: DDGS):
+    """検索に成功したDDGSインスタンスをプールに戻す（上限を超える分は破棄）"""
+    with _ddgs_pool_lock:
+        if len(_ddgs_pool) < DDGS_POOL_SIZE:
+            _ddgs_pool.append(ddgs)
+
+
+# DDGSの検索結果から title / href / body をまとめて取り出す（C実装のため .get の繰り返しより高速）
+_get_result_fields = itemgetter("title", "href", "body")
+
+
+def _normalize_results(raw_results: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """DDGSの検索結果を title / url / snippet 形式に変換"""
+    normalized = []
+    for result in raw_results:
+        try:
+            title, url, snippet = _get_result_fields(result)
+        except KeyError:
+            # 一部のキーが欠けている結果のみ個別に取得
+            title, url, snippet = result.get("title"), result.get("href"), result.get("body")
+        normalized.append({"title": title or "", "url": url or "", "snippet": snippet or ""})
+    return normalized
+
+
+def _search_sync(query: str, max_results: int) -> List[Dict[str, Any]]:
+    """
+    DDGSで同期的に検索し、結果を統一フォーマットに変換
+    
+    ブロッキング処理のため、非同期コードからは asyncio.to_thread 経由で呼び出す
+    検索に失敗したインスタンスはブロック・切断されている可能性があるため、プールに戻さない
+    """
+    ddgs = _acquire_ddgs()
+    results = _normalize_results(ddgs.text(query, max_results=max_results))
+    _release_ddgs(ddgs)
+    return results
+
+
+def _is_cjk(text: str) -> bool:
+    """ひらがな・カタカナ・漢字を含むか（最初に見つかった時点で判定を終える）"""
+    return any(0x3040 <= ord(char) <= 0x9FFF for char in text)
+
+
+async def _search_ja_first(query: str, max_results: int) -> List[Dict[str, Any]]:
+    """
+    日本語検索の結果を優先し、足りない場合のみ指定なしの検索で補う（同じURLの結果は除外）
+    
+    DDGへのリクエスト数を抑えるため、指定なしの検索は日本語検索の完了後に必要な場合だけ行う
+    """
+    kpi_monitor.record_search_requests(1)
+    results = await asyncio.to_thread(_search_sync, f"{query} lang:ja", max_results)
+    if len(results) >= max_results:
+        return results
+    
+    kpi_monitor.record_search_requests(1)
+    seen_urls = {result["url"] for result in results}
+    for result in await asyncio.to_thread(_search_sync, query, max_results):
+        if result["url"] in seen_urls:
+            continue
+        seen_urls.add(result["url"])
+        results.append(result)
+        if len(results) >= max_results:
+            break
+    return results
+
+
 async def web_search_with_retry(query: str, max_results: int = 5, max_retries: int = 3) -> List[Dict[str, Any]]:
     """
     リトライ機能付きのWeb検索実装
@@ -36,35 +173,69 @@ async def web_search_with_retry(query: str, max_results: int = 5, max_retries: i
     Returns:
         検索結果のリスト
     """
+    normalized_query = normalize_query(query)
+    cache_key = f"{normalized_query}|{max_results}"
+    
+    cached_results = _memory_cache_get(cache_key)
+    if cached_results is not None:
+        return cached_results
+    
+    # 同じクエリの検索が実行中であれば、その結果を待つ
+    task = _inflight_searches.get(cache_key)
+    if task is None:
+        task = asyncio.create_task(
+            _web_search_uncached(query, normalized_query, cache_key, max_results, max_retries)
+        )
+        _inflight_searches[cache_key] = task
+        task.add_done_callback(lambda _: _inflight_searches.pop(cache_key, None))
+    
+    # 呼び出し元がキャンセルされても、待機中の他の呼び出し元のために検索は継続する
+    return await asyncio.shield(task)
+
+
+async def _web_search_uncached(
+    query: str,
+    normalized_query: str,
+    cache_key: str,
+    max_results: int,
+    max_retries: int
+) -> List[Dict[str, Any]]:
+    """永続キャッシュ・類似クエリキャッシュを確認し、なければDDGSで検索する"""
+    cache_namespace = f"search:{max_results}"
+    
+    # キャッシュを確認（完全一致 → 類似クエリの順）
+    # SQLiteへのアクセスはブロッキング処理のため、スレッドで実行する
+    cached_results = await asyncio.to_thread(search_cache.get, cache_key)
+    if cached_results is not None:
+        _memory_cache_set(cache_key, cached_results)
+        return cached_results
+    
+    cached_results = await semantic_search_cache.lookup(cache_namespace, normalized_query)
+    if cached_results is not None:
+        return cached_results
+    
     for attempt in range(max_retries):
+        # ブロッキング処理はスレッドで実行し、イベントループを塞がない
         try:
-            # 日本語検索を優先
-            search_query = f"{query} lang:ja"
-            results = []
-            
-            with DDGS() as ddgs:
-                for result in ddgs.text(search_query, max_results=max_results):
-                    results.append({
-                        "title": result.get("title", ""),
-                        "url": result.get("href", ""),
-                        "snippet": result.get("body", "")
-                    })
+            if not _is_cjk(query):
+                # 日本語を含まないクエリは lang:ja 指定の検索を行わない
+                kpi_monitor.record_search_requests(1)
+                results = await asyncio.to_thread(_search_sync, query, max_results)
+            else:
+                results = await _search_ja_first(query, max_results)
             
-            # 日本語検索で結果が少ない場合は英語でも検索
-            if len(results) < max_results:
-                with DDGS() as ddgs:
-                    for result in ddgs.text(query, max_results=max_results-len(results)):
-                        results.append({
-                            "title": result.get("title", ""),
-                            "url": result.get("href", ""),
-                            "snippet": result.get("body", "")
-                        })
+            # 結果が得られた場合のみキャッシュに保存
+            if results:
+                _memory_cache_set(cache_key, results)
+                await asyncio.to_thread(search_cache.set, cache_key, results)
+                # プロセス内のキャッシュのため、結果のリストをそのまま保持する
+                await semantic_search_cache.store(cache_namespace, normalized_query, results)
             
-            return results if results else []
+            return results
             
         except Exception as e:
             if attempt < max_retries - 1:
-                await asyncio.sleep(1)  # 1秒待機してリトライ
+                await asyncio.sleep(SEARCH_RETRY_BASE_DELAY * 2 ** attempt)  # 指数バックオフでリトライ
                 continue
             else:
                 return [{